@@ -0,0 +1,176 @@
+# Copyright 2013-2016 Tom Eulenfeld, MIT license
+"""
+Benchmarks of the read and write paths of obspyh5
+
+The benchmarks are compatible with airspeed velocity (asv) and can also be
+run without asv by benchmarks/run.py. All data is synthetic and generated
+locally.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime as UTC
+
+import obspyh5
+from obspyh5 import iterh5, read_headers, readh5, set_index, writeh5
+
+
+# number of traces x number of samples, about 1e6 to 1e7 samples each
+SIZES = ('10x100000', '1000x10000', '100000x100', '1000000x10')
+INDEXES = tuple(sorted(obspyh5._INDEXES))
+OPTIONS = {
+    'none': {},
+    'gzip': {'compression': 'gzip'},
+    'gzip-shuffle': {'compression': 'gzip', 'shuffle': True},
+    'lzf': {'compression': 'lzf'},
+    'scaleoffset': {'scaleoffset': 3},
+    'int32': {'dtype': 'int32'},
+    'auto': {'compression': 'auto'}}
+LIBVERS = ('earliest', 'latest')
+HEADER_CODECS = obspyh5._HEADER_CODECS
+
+
+def parse_size(size):
+    """Return number of traces and number of samples of size string."""
+    ntraces, npts = size.split('x')
+    return int(ntraces), int(npts)
+
+
+def make_stream(size, index='standard', seed=42):
+    """
+    Create synthetic stream with random data.
+
+    Station names and start times vary, so that all indexes are unique.
+    Headers needed by the xcorr index are added for this index.
+    """
+    ntraces, npts = parse_size(size)
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((ntraces, npts)).astype('float32')
+    t0 = UTC('2020-01-01')
+    traces = []
+    for i in range(ntraces):
+        header = {'network': 'XX', 'station': 'S%03d' % (i % 1000),
+                  'channel': 'HH' + 'ZNE'[i % 3], 'sampling_rate': 100.,
+                  'starttime': t0 + 1000 * (i // 1000)}
+        if index == 'xcorr':
+            header.update(
+                network1='XX', station1=header['station'], location1='',
+                channel1=header['channel'], network2='XX', station2='S000',
+                location2='', channel2='HHZ')
+        traces.append(Trace(data=data[i], header=header))
+    return Stream(traces)
+
+
+def nbytes(size):
+    """Size of the data of a synthetic stream in bytes."""
+    ntraces, npts = parse_size(size)
+    return ntraces * npts * 4
+
+
+class _FileBenchmark(object):
+    """Base class managing a temporary directory and the index."""
+
+    timeout = 3600
+
+    def _setup(self, index='standard'):
+        self.tmpdir = tempfile.mkdtemp(prefix='obspyh5_bench_')
+        self.fname = os.path.join(self.tmpdir, 'bench.h5')
+        set_index(index)
+
+    def teardown(self, *args):
+        set_index()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+class WriteIndex(_FileBenchmark):
+    """Write streams of different sizes with each index."""
+
+    params = (SIZES, INDEXES)
+    param_names = ('size', 'index')
+
+    def setup(self, size, index):
+        self._setup(index)
+        self.stream = make_stream(size, index)
+
+    def time_writeh5(self, size, index):
+        writeh5(self.stream, self.fname)
+
+    def peakmem_writeh5(self, size, index):
+        writeh5(self.stream, self.fname)
+
+    def track_file_size(self, size, index):
+        writeh5(self.stream, self.fname)
+        return os.path.getsize(self.fname)
+    track_file_size.unit = 'bytes'
+
+
+class WriteOptions(_FileBenchmark):
+    """Write streams with different filters, libver and header codecs."""
+
+    params = (SIZES, tuple(OPTIONS), LIBVERS, HEADER_CODECS)
+    param_names = ('size', 'options', 'libver', 'header_codec')
+
+    def setup(self, size, options, libver, header_codec):
+        self._setup()
+        self.stream = make_stream(size)
+        self.kwargs = dict(OPTIONS[options], libver=libver,
+                           header_codec=header_codec)
+
+    def time_writeh5(self, *args):
+        writeh5(self.stream, self.fname, **self.kwargs)
+
+    def track_file_size(self, *args):
+        writeh5(self.stream, self.fname, **self.kwargs)
+        return os.path.getsize(self.fname)
+    track_file_size.unit = 'bytes'
+
+
+class ReadIndex(_FileBenchmark):
+    """Read files of different sizes written with each index."""
+
+    params = (SIZES, INDEXES)
+    param_names = ('size', 'index')
+
+    def setup(self, size, index):
+        self._setup(index)
+        writeh5(make_stream(size, index), self.fname)
+        self.t1 = UTC('2020-01-01') + 1000 * (parse_size(size)[0] // 2000)
+
+    def time_readh5(self, size, index):
+        readh5(self.fname)
+
+    def peakmem_readh5(self, size, index):
+        readh5(self.fname)
+
+    def time_readh5_headonly(self, size, index):
+        readh5(self.fname, headonly=True)
+
+    def time_iterh5(self, size, index):
+        for _ in iterh5(self.fname):
+            pass
+
+    def time_readh5_time_window(self, size, index):
+        readh5(self.fname, starttime=self.t1, endtime=self.t1 + 10)
+
+    def time_read_headers(self, size, index):
+        read_headers(self.fname)
+
+
+class ReadOptions(_FileBenchmark):
+    """Read files written with different filters, libver and codecs."""
+
+    params = (SIZES, tuple(OPTIONS), LIBVERS, HEADER_CODECS)
+    param_names = ('size', 'options', 'libver', 'header_codec')
+
+    def setup(self, size, options, libver, header_codec):
+        self._setup()
+        writeh5(make_stream(size), self.fname, libver=libver,
+                header_codec=header_codec, **OPTIONS[options])
+
+    def time_readh5(self, *args):
+        readh5(self.fname)
+
+    def time_readh5_headonly(self, *args):
+        readh5(self.fname, headonly=True)
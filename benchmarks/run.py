@@ -0,0 +1,137 @@
+# Copyright 2013-2016 Tom Eulenfeld, MIT license
+"""
+Run the obspyh5 benchmarks without asv
+
+Reports wall time (best of repeats), throughput and peak memory of all
+time_* benchmarks and the values of all track_* benchmarks.
+Peak memory is measured with tracemalloc in a separate run and includes
+allocations of Python and numpy, but not of the HDF5 library.
+peakmem_* benchmarks are only run by asv.
+
+Examples::
+
+    python benchmarks/run.py  # quick run with the first two sizes
+    python benchmarks/run.py --full --json results.json
+    python benchmarks/run.py -b 'ReadIndex.time_readh5$' --size 1000x10000
+"""
+import argparse
+from itertools import product
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import benchmarks  # noqa: E402
+
+
+def _classes():
+    for name in sorted(dir(benchmarks)):
+        obj = getattr(benchmarks, name)
+        if (isinstance(obj, type) and not name.startswith('_') and
+                hasattr(obj, 'params')):
+            yield name, obj
+
+
+def _run(cls, method, params):
+    """Run benchmark method once and return result of method."""
+    bench = cls()
+    bench.setup(*params)
+    try:
+        return getattr(bench, method)(*params)
+    finally:
+        bench.teardown(*params)
+
+
+def _measure(cls, method, params, repeat):
+    """Return best wall time and peak memory of the benchmark method."""
+    times = []
+    for _ in range(repeat):
+        bench = cls()
+        bench.setup(*params)
+        try:
+            t0 = time.perf_counter()
+            getattr(bench, method)(*params)
+            times.append(time.perf_counter() - t0)
+        finally:
+            bench.teardown(*params)
+    bench = cls()
+    bench.setup(*params)
+    try:
+        tracemalloc.start()
+        getattr(bench, method)(*params)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        bench.teardown(*params)
+    return min(times), peak
+
+
+def run(pattern=None, sizes=None, repeat=3, out=sys.stdout):
+    """
+    Run benchmarks and return list of results.
+
+    :param pattern: only run benchmarks whose name 'Class.method' matches
+        this regular expression
+    :param sizes: only use these sizes, defaults to all sizes
+    :param repeat: number of repeats for timing
+    """
+    results = []
+    for name, cls in _classes():
+        methods = [m for m in sorted(dir(cls))
+                   if m.startswith(('time_', 'track_'))]
+        for method in methods:
+            bname = '%s.%s' % (name, method)
+            if pattern is not None and not re.search(pattern, bname):
+                continue
+            for params in product(*cls.params):
+                size = params[0]
+                if sizes is not None and size not in sizes:
+                    continue
+                label = '%s(%s)' % (bname, ', '.join(params))
+                result = {'benchmark': bname,
+                          'params': dict(zip(cls.param_names, params))}
+                if method.startswith('track_'):
+                    result['value'] = _run(cls, method, params)
+                    msg = '%s = %s' % (label, result['value'])
+                else:
+                    wall, peak = _measure(cls, method, params, repeat)
+                    ntraces, _ = benchmarks.parse_size(size)
+                    mbytes = benchmarks.nbytes(size) / 1e6
+                    result.update(wall_time=wall, peak_memory=peak,
+                                  traces_per_second=ntraces / wall,
+                                  mbytes_per_second=mbytes / wall)
+                    msg = ('%s: %.4fs, %.0f traces/s, %.1f MB/s, '
+                           'peak %.1f MB' % (label, wall, ntraces / wall,
+                                             mbytes / wall, peak / 1e6))
+                print(msg, file=out)
+                out.flush()
+                results.append(result)
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-b', '--bench', help='regular expression selecting '
+                        'benchmarks by their name Class.method')
+    parser.add_argument('--size', action='append', choices=benchmarks.SIZES,
+                        help='run only with this size, can be repeated')
+    parser.add_argument('--full', action='store_true',
+                        help='run with all sizes, default: first two sizes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of repeats for timing (default: 3)')
+    parser.add_argument('--json', help='write results to this JSON file')
+    args = parser.parse_args(args)
+    sizes = args.size
+    if sizes is None and not args.full:
+        sizes = benchmarks.SIZES[:2]
+    results = run(args.bench, sizes=sizes, repeat=args.repeat)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,8 +17,27 @@ For some examples have a look at the README.rst_.
 .. _README.rst: https://github.com/trichter/obspyh5
 
 """
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from fnmatch import fnmatchcase
+import hashlib
+import io
+from itertools import islice
 import json
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import os
 from os.path import splitext
+import posixpath
+import re
+import string
+import sys
+import threading
+import time
+import zlib
 from warnings import warn
 
 import numpy as np
@@ -29,10 +48,24 @@ try:
 except ImportError:
     pass
 
-__version__ = '0.6.1-dev'
+__version__ = '0.7.0-dev'
 
 _IGNORE = ('endtime', 'sampling_rate', 'npts', '_format')
 
+# common headers stored in one compound attribute by the compact codec
+_COMPACT_FIELDS = ('network', 'station', 'location', 'channel',
+                   'starttime', 'delta', 'calib')
+_HEADER_CODECS = ('attrs', 'compact')
+# attributes used by obspyh5 itself, they are not returned as headers
+_INTERNAL_ATTRS = ('_hash', '_codec', '_dtype')
+
+# filter pipelines tried by compression='auto', ordered by decoding speed
+_AUTO_CODECS = OrderedDict([
+    ('none', {}),
+    ('lzf', {'compression': 'lzf', 'shuffle': True}),
+    ('scaleoffset', {'scaleoffset': 0, 'compression': 'gzip'}),
+    ('gzip', {'compression': 'gzip', 'shuffle': True})])
+
 _INDEXES = {
     'standard': (
         'waveforms/{trc_num:03d}_{id}_'
@@ -52,6 +85,15 @@ _INDEX = _INDEXES['standard']
 
 _NOT_SERIALIZABLE = '<not serializable>'
 
+_HEADER_TABLE = '_obspyh5_headers'
+# files linked into a master file by consolidate
+_SOURCES = '_obspyh5_sources'
+
+_HEADER_FIELDS = ('id', 'starttime', 'endtime', 'sampling_rate', 'npts')
+
+_PACKED = '_packed_'
+_PACKED_HEADERS = '_headers'
+
 
 def _is_utc(utc):
     utc = str(utc)
@@ -69,6 +111,139 @@ class _FlexibleEncoder(json.JSONEncoder):
         return _NOT_SERIALIZABLE
 
 
+class _TaggedEncoder(_FlexibleEncoder):
+    """Encoder tagging UTCDateTime objects with their nanoseconds."""
+    def default(self, obj):
+        if isinstance(obj, UTC):
+            return {'__utc__': obj.ns}
+        return super(_TaggedEncoder, self).default(obj)
+
+
+class _HashEncoder(_TaggedEncoder):
+    """Encoder for hashing headers, numpy values are converted silently."""
+    def default(self, obj):
+        if isinstance(obj, np.generic):
+            return obj.item()
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
+        elif isinstance(obj, (UTC, AttribDict)):
+            return super(_HashEncoder, self).default(obj)
+        return repr(obj)
+
+
+class _SegmentEncoder(_HashEncoder):
+    """Encoder comparing headers with headers decoded from a file."""
+    def default(self, obj):
+        if isinstance(obj, UTC):
+            # precision of UTCDateTime objects stored as strings
+            return str(obj)
+        elif isinstance(obj, (np.generic, np.ndarray, AttribDict)):
+            return super(_SegmentEncoder, self).default(obj)
+        return _NOT_SERIALIZABLE
+
+
+def _json_hook(obj):
+    """Decode UTCDateTime objects tagged by _TaggedEncoder."""
+    if len(obj) == 1 and '__utc__' in obj:
+        return UTC(ns=obj['__utc__'])
+    return obj
+
+
+class Profile(object):
+    """
+    Collect counters and timings of read and write phases.
+
+    Profiling is enabled while the context manager is active::
+
+        with Profile() as prof:
+            stream = readh5('huge_in.h5')
+        print(prof.as_dict())
+
+    Timings in seconds are collected for the phases 'open' (opening files),
+    'traverse' (visiting datasets and reading the header table),
+    'decode' (decoding headers, includes 'json'), 'json' (parsing JSON),
+    'read' (reading data), 'write_data' (creating datasets and writing data),
+    'write_attrs' (writing headers) and 'flush' (writing the header table).
+    Counters are 'files_opened', 'file_cache_hits' (see set_file_cache),
+    'datasets_visited', 'attrs_decoded',
+    'attrs_written', 'traces_read', 'traces_written', 'bytes_read' and
+    'bytes_written'.
+    Work done in other threads is included, work done in other processes
+    (readh5_many) is not. Without an active profile the overhead is
+    negligible.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        _PROFILES.append(self)
+        return self
+
+    def __exit__(self, *args):
+        _PROFILES.remove(self)
+
+    def count(self, name, n=1):
+        """Increase counter name by n."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, phase, seconds):
+        """Add seconds to the timing of phase."""
+        with self._lock:
+            self.timings[phase] = self.timings.get(phase, 0.) + seconds
+
+    def as_dict(self):
+        """Return counters and timings as dict."""
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'timings': dict(self.timings)}
+
+
+# active profiles
+_PROFILES = []
+
+
+def _count(name, n=1):
+    for prof in _PROFILES:
+        prof.count(name, n)
+
+
+class _Timer(object):
+    __slots__ = ('phase', 't0')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self.t0
+        for prof in _PROFILES:
+            prof.add_time(self.phase, seconds)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _timer(phase):
+    """Return context manager timing phase if profiling is enabled."""
+    return _Timer(phase) if _PROFILES else _NULL_TIMER
+
+
 def set_index(index='standard'):
     """
     Set index for newly created files.
@@ -102,44 +277,437 @@ def is_obspyh5(fname):
     try:
         if not h5py.is_hdf5(fname):
             return False
-        with h5py.File(fname, 'r') as f:
+        with _open(fname) as f:
             return f.attrs['file_format'].lower() == 'obspyh5'
     except Exception:
         return False
 
 
-def iterh5(fname, group='/', readonly=None, headonly=False, mode='r'):
+def _header_dtype():
+    return np.dtype([('id', h5py.string_dtype()),
+                     ('starttime', 'i8'), ('endtime', 'i8'),
+                     ('sampling_rate', 'f8'), ('npts', 'i8'),
+                     ('path', h5py.string_dtype()), ('row', 'i8')])
+
+
+def _packed_dtype():
+    return np.dtype([('id', h5py.string_dtype()),
+                     ('starttime', 'i8'), ('endtime', 'i8'),
+                     ('sampling_rate', 'f8'), ('npts', 'i8'),
+                     ('header', h5py.string_dtype())])
+
+
+def _compact_dtype():
+    string = h5py.string_dtype()
+    return np.dtype([('network', string), ('station', string),
+                     ('location', string), ('channel', string),
+                     ('starttime', 'i8'), ('delta', 'f8'), ('calib', 'f8')])
+
+
+def _compact_fields(header):
+    """Return common headers stored in the compound attribute."""
+    fields = {}
+    for key in _COMPACT_FIELDS[:4]:
+        val = header[key]
+        fields[key] = val.decode('utf-8') if isinstance(val, bytes) else val
+    fields['starttime'] = UTC(ns=int(header['starttime']))
+    fields['delta'] = float(header['delta'])
+    fields['calib'] = float(header['calib'])
+    return fields
+
+
+def _header_row(trace, dataset, row=-1):
+    """Return row of the header table for a trace written to dataset."""
+    stats = trace.stats
+    return (trace.id, stats.starttime.ns, stats.endtime.ns,
+            stats.sampling_rate, stats.npts, dataset.name, row)
+
+
+def _append_rows(table, rows):
+    """Append rows to a resizable table."""
+    rows = np.array(rows, dtype=table.dtype)
+    n = len(table)
+    table.resize((n + len(rows),))
+    table[n:] = rows
+
+
+def _append_header_rows(f, rows):
+    """Append rows to the header table, if the file has one."""
+    if len(rows) == 0 or _HEADER_TABLE not in f:
+        return
+    _append_rows(f[_HEADER_TABLE], rows)
+
+
+def _read_header_table(f, group, refresh=False, levels=()):
+    """
+    Read rows of the header table belonging to group.
+
+    levels restrict the rows to paths matching the index, see _walk.
+
+    Returns None if the file does not have a header table.
+    Rows of overridden datasets are removed.
+    """
+    if _HEADER_TABLE not in f:
+        return None
+    table = f[_HEADER_TABLE]
+    if refresh:
+        table.refresh()
+    table = table[()]
+    # later rows describe overridden datasets, keep the last row of each path
+    plain = np.nonzero(table['row'] < 0)[0]
+    paths = table['path'][plain]
+    _, ind = np.unique(paths[::-1], return_index=True)
+    keep = np.concatenate([plain[len(paths) - 1 - ind],
+                           np.nonzero(table['row'] >= 0)[0]])
+    table = table[np.sort(keep)]
+    if group.name != '/':
+        paths = table['path'].astype(bytes)
+        prefix = group.name.encode('utf-8')
+        mask = ((paths == prefix) |
+                np.char.startswith(paths, prefix + b'/'))
+        table = table[mask]
+    if any(level is not None for level in levels):
+        n = len(group.name.rstrip('/')) + 1
+        mask = [_match_levels(levels, path.decode('utf-8')[n:].split('/'))
+                for path in table['path']]
+        table = table[np.array(mask, dtype=bool)]
+        # match the traces of packed datasets one by one
+        mask = np.ones(len(table), dtype=bool)
+        packed = np.nonzero(table['row'] >= 0)[0]
+        for path in np.unique(table['path'][packed]):
+            ind = packed[table['path'][packed] == path]
+            path = path.decode('utf-8')
+            if path in f:
+                rows = set(_packed_rows(f[path], levels, table['row'][ind]))
+                mask[ind] = [row in rows for row in table['row'][ind]]
+        table = table[mask]
+    return table
+
+
+def _is_packed(dataset):
+    return dataset.name.rsplit('/', 1)[-1].startswith(_PACKED)
+
+
+def _match_level(level, name):
+    """Check if name of group or dataset matches level of the index."""
+    if level is None or name.startswith(_PACKED):
+        return True
+    elif isinstance(level, str):
+        return name == level
+    return level.fullmatch(name) is not None
+
+
+def _match_levels(levels, names):
+    return all(_match_level(level, name)
+               for level, name in zip(levels, names))
+
+
+def _match_packed(levels, index, stats, npts):
+    """
+    Check if a trace of a packed dataset matches levels of the index.
+
+    The packed dataset replaces the last level of the index, the names
+    of all levels are formatted with the headers of the trace.
+    """
+    if all(level is None for level in levels):
+        return True
+    trace = Trace(header=dict(stats, npts=npts))
+    try:
+        names = _format_index(index, trace, 0).split('/')
+    except (AttributeError, KeyError, IndexError, ValueError):
+        return False
+    return _match_levels(levels, names)
+
+
+def _packed_rows(dataset, levels, rows=None):
+    """Return rows of a packed dataset matching levels of the index."""
+    rows = range(len(dataset)) if rows is None else rows
+    if all(level is None for level in levels):
+        return list(rows)
+    index = dataset.file.attrs.get('index', _INDEX)
+    headers = dataset.file[dataset.name + _PACKED_HEADERS].fields(
+        'header')[()]
+    npts = dataset.shape[-1]
+    return [row for row in rows if row < len(headers) and _match_packed(
+        levels, index, _decode_packed_header(headers[row]), npts)]
+
+
+def _walk(group, levels=()):
     """
-    Iterate over traces in HDF5 file. See readh5 for doc of kwargs.
+    Visit all items iteratively and yield datasets holding traces.
+
+    levels is a list with one entry for each level of the index,
+    entries are None (visit all items), a name or a compiled regex.
+    Items not matching the corresponding level are not visited.
     """
-    def visit(group):
-        """Visit all items iteratively and yield datasets as traces."""
-        if isinstance(group, h5py.Dataset):
-            yield dataset2trace(group, headonly=headonly)
+    if isinstance(group, h5py.Dataset):
+        yield group
+        return
+    level = levels[0] if len(levels) > 0 else None
+    if isinstance(level, str) and len(levels) > 1:
+        # direct access without iterating over all items in group
+        names = [level] if level in group else []
+    else:
+        names = [sub for sub in group if _match_level(level, sub)]
+    skip = (_HEADER_TABLE, _SOURCES)
+    for sub in names:
+        if sub in skip:
+            continue
+        if sub.startswith(_PACKED) and sub.endswith(_PACKED_HEADERS):
+            continue
+        for dataset in _walk(group[sub], levels[1:]):
+            yield dataset
+
+
+def _scan_headers(group, levels=()):
+    """Build header table rows by visiting all datasets in group."""
+    rows = []
+    for dataset in _walk(group, levels):
+        if _is_packed(dataset):
+            headers = dataset.file[dataset.name + _PACKED_HEADERS].fields(
+                ['id', 'starttime', 'endtime', 'sampling_rate', 'npts'])[()]
+            for row in _packed_rows(dataset, levels):
+                h = headers[row]
+                rows.append((h['id'].decode('utf-8'),) + tuple(h)[1:] +
+                            (dataset.name, row))
+            continue
+        attrs = dataset.attrs
+        if '_header' in attrs:
+            stats = _compact_fields(attrs['_header'])
+            stats['npts'] = len(dataset)
+            rows.append(_header_row(Trace(header=stats), dataset))
+            continue
+        stats = {}
+        for key in ('network', 'station', 'location', 'channel',
+                    'starttime', 'delta'):
+            if key in attrs:
+                val = attrs[key]
+                if isinstance(val, bytes):
+                    val = val.decode('utf-8')
+                stats[key] = val
+        stats['npts'] = len(dataset)
+        rows.append(_header_row(Trace(header=stats), dataset))
+    return np.array(rows, dtype=_header_dtype())
+
+
+def _filter_headers(table, starttime=None, endtime=None, seed_id=None):
+    """Return rows of the header table matching the given constraints."""
+    mask = np.ones(len(table), dtype=bool)
+    if starttime is not None:
+        mask &= table['endtime'] >= UTC(starttime).ns
+    if endtime is not None:
+        mask &= table['starttime'] <= UTC(endtime).ns
+    if seed_id is not None:
+        ids = table['id'].astype(bytes)
+        uids = [uid.decode('utf-8') for uid in np.unique(ids)]
+        matching = [uid.encode('utf-8') for uid in uids
+                    if fnmatchcase(uid, seed_id)]
+        mask &= np.isin(ids, matching)
+    return table[mask]
+
+
+def _glob2regex(pattern):
+    """Translate pattern with wildcards '*', '?' and '[]' to regex."""
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        j = pattern.find(']', i + 2)
+        if c == '*':
+            regex.append('.*')
+        elif c == '?':
+            regex.append('.')
+        elif c == '[' and j > 0:
+            chars = pattern[i + 1:j]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex.append('[%s]' % chars.replace('\\', '\\\\'))
+            i = j
         else:
-            for sub in group:
-                for subgroup in visit(group[sub]):
-                    yield subgroup
-    with h5py.File(fname, mode) as f:
-        if readonly is not None:
-            try:
-                index = f.attrs['index']
-            except KeyError:
-                index = _INDEX
-            index1 = index.split('/')
-            index2 = []
-            for i in index1:
-                try:
-                    index2.append(i.format(**readonly))
-                except KeyError:
-                    break
-            group = '/'.join([group] + index2)
-        for v in visit(f[group]):
-            yield v
+            regex.append(re.escape(c))
+        i += 1
+    return ''.join(regex)
+
+
+def _readonly_regex(field, value, readonly):
+    """Return regex for the value of field in readonly."""
+    if isinstance(value, re.Pattern):
+        return '(?:%s)' % value.pattern
+    elif isinstance(value, (list, tuple, set)):
+        return '(?:%s)' % '|'.join(_readonly_regex(field, v, readonly)
+                                   for v in value)
+    elif isinstance(value, str) and any(c in value for c in '*?['):
+        return _glob2regex(value)
+    key = _field_key(field[0])
+    return re.escape(_format_field(field, dict(readonly, **{key: value})))
+
+
+def _field_key(field_name):
+    return re.split(r'[.\[]', field_name, maxsplit=1)[0]
+
+
+def _format_field(field, kwargs):
+    field_name, spec, conversion = field
+    fmt = '{' + field_name
+    if conversion:
+        fmt += '!' + conversion
+    if spec:
+        fmt += ':' + spec
+    return (fmt + '}').format(**kwargs)
+
+
+def _select_group(f, group='/', readonly=None):
+    """
+    Return group and levels of the index restricted by readonly.
+
+    See _walk for a description of levels.
+    """
+    group = f[group]
+    if readonly is None:
+        return group, []
+    try:
+        index = f.attrs['index']
+    except KeyError:
+        index = _INDEX
+    levels = []
+    for template in index.split('/'):
+        fields = [(field, spec, conversion) for _, field, spec, conversion
+                  in string.Formatter().parse(template) if field is not None]
+        keys = [_field_key(field[0]) for field in fields]
+        if not any(key in readonly for key in keys):
+            levels.append(None)
+            continue
+        plain = all(key in readonly and not isinstance(
+            readonly[key], (re.Pattern, list, tuple, set)) and not (
+            isinstance(readonly[key], str) and
+            any(c in readonly[key] for c in '*?[')) for key in keys)
+        if plain:
+            levels.append(template.format(**readonly))
+            continue
+        regex = []
+        for literal, field, spec, conversion in string.Formatter().parse(
+                template):
+            regex.append(re.escape(literal))
+            if field is None:
+                continue
+            key = _field_key(field)
+            if key in readonly:
+                regex.append(_readonly_regex((field, spec, conversion),
+                                             readonly[key], readonly))
+            else:
+                regex.append('.*?')
+        levels.append(re.compile(''.join(regex)))
+    return group, levels
+
+
+def iterh5(fname, group='/', readonly=None, headonly=False, mode='r',
+           starttime=None, endtime=None, seed_id=None, pad=False,
+           fill_value=None, mmap=False, lazy=False, swmr=False):
+    """
+    Iterate over traces in HDF5 file. See readh5 for doc of kwargs.
+    """
+    if pad and (headonly or lazy):
+        raise ValueError('pad is not supported with headonly or lazy')
+    kw = dict(headonly=headonly, starttime=starttime, endtime=endtime,
+              pad=pad, fill_value=fill_value, mmap=mmap, lazy=lazy)
+    kwargs = dict(libver='latest', swmr=True) if swmr else {}
+    with _open(fname, mode, **kwargs) as f:
+        group, levels = _select_group(f, group, readonly)
+        if starttime is None and endtime is None and seed_id is None:
+            datasets = _walk(group, levels)
+            while True:
+                with _timer('traverse'):
+                    dataset = next(datasets, None)
+                if dataset is None:
+                    return
+                if _PROFILES:
+                    _count('datasets_visited')
+                if swmr:
+                    dataset.refresh()
+                if _is_packed(dataset):
+                    for tr in _packed2traces(dataset, refresh=swmr,
+                                             levels=levels, **kw):
+                        yield tr
+                else:
+                    yield dataset2trace(dataset, **kw)
+        with _timer('traverse'):
+            table = _read_header_table(f, group, refresh=swmr,
+                                       levels=levels)
+            if table is None:
+                table = _scan_headers(group, levels)
+            table = _filter_headers(table, starttime=starttime,
+                                    endtime=endtime, seed_id=seed_id)
+        for path, row in zip(table['path'], table['row']):
+            path = path.decode('utf-8') if isinstance(path, bytes) else path
+            if path in f:
+                dataset = f[path]
+                if _PROFILES:
+                    _count('datasets_visited')
+                if swmr:
+                    dataset.refresh()
+                if row < 0:
+                    yield dataset2trace(dataset, **kw)
+                elif row < len(dataset):
+                    yield dataset2trace(dataset, row=row, **kw)
+
+
+_END = object()
+
+
+async def aiterh5(fname, group='/', readonly=None, headonly=False,
+                  prefetch=4, executor=None, **kwargs):
+    """
+    Asynchronously iterate over traces in HDF5 file.
+
+    The file is read in a background thread, so that the event loop is not
+    blocked. Up to prefetch traces are read ahead while the consumer
+    processes the current trace. Usage::
+
+        async for trace in aiterh5('huge_in.h5'):
+            await do_something(trace)
+
+    :param prefetch: maximal number of traces read in advance
+    :param executor: executor used for the background thread,
+        defaults to the default executor of the event loop
+    :param group, readonly, headonly, **kwargs: see readh5
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(prefetch)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for tr in iterh5(fname, group=group, readonly=readonly,
+                             headonly=headonly, **kwargs):
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, (tr, None))
+            loop.call_soon_threadsafe(queue.put_nowait, (_END, None))
+        except Exception as ex:
+            loop.call_soon_threadsafe(queue.put_nowait, (_END, ex))
+
+    producer = loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            tr, ex = await queue.get()
+            if ex is not None:
+                raise ex
+            if tr is _END:
+                break
+            slots.release()
+            yield tr
+    finally:
+        stop.set()
+        await producer
 
 
 def readh5(fname, group='/', headonly=False, readonly=None, mode='r',
-           **kwargs):
+           starttime=None, endtime=None, seed_id=None, pad=False,
+           fill_value=None, mmap=False, lazy=False, swmr=False, **kwargs):
     """
     Read HDF5 file and return Stream object.
 
@@ -148,27 +716,377 @@ def readh5(fname, group='/', headonly=False, readonly=None, mode='r',
         This can alos point to a dataset. group can be used to read only a
         part of the HDF5 file.
     :param readonly: read only traces restricted by given dict.
-        The index will be filled from left to right with the corresponding
-        values and a stream consisiting of all traces in the most-nested but
-        still fully specified group will be returned.
-        E.g. with the standard index the dict
+        Each level of the index is matched against the names of the groups
+        with the corresponding values, groups not matching are not visited.
+        Values can be strings with the wildcards '*', '?' and '[]', lists of
+        values or compiled regular expressions.
+        E.g. with the nested index the dict
         {'network': 'NET', 'station': 'STA'} will return all traces in NET.STA/
+        and {'channel': ['BH?', 'HH?']} all BH and HH channels.
     :param headonly: read only the headers of the traces
     :param mode: 'r' (read-only, default), 'a' (append) or other.
         Argument is passed to h5py.File. Use 'a' if you want to write in the
         same file, while it is open for reading.
+    :param starttime: read only traces ending at or after starttime,
+        traces are cut at starttime
+    :param endtime: read only traces starting at or before endtime,
+        traces are cut at endtime
+    :param seed_id: read only traces with this SEED id,
+        wildcards '*' and '?' are supported
+        The last three constraints are answered from the header table
+        stored in files created with obspyh5 >= 0.7.0, only the matching
+        datasets are accessed. For older files all datasets are visited.
+        Only the samples inside the time window are read from disk.
+    :param pad, fill_value: pad traces to the requested time window,
+        see Trace.trim, not supported with headonly or lazy
+    :param mmap: return read-only numpy memory maps as data of traces
+        stored in contiguous datasets without compression or other filters,
+        other datasets are read as usual. Samples are only read from disk
+        when accessed and the page cache of the OS is shared between
+        processes. Processing methods working in-place on the data of a
+        memory-mapped trace will fail, make a copy of the trace before.
+    :param lazy: only read headers, the data of each trace is read from the
+        file when it is accessed the first time.
+        Loaded data is held in a cache of limited size (see set_cache_size)
+        and is read-only. Loading data raises an OSError if the file was
+        changed after reading (except in SWMR mode). Processing methods
+        assigning new data to the trace keep the new data in memory.
+    :param swmr: open file in single-writer/multiple-reader mode to read
+        a file while a H5Writer with swmr=True is appending to it.
+        Datasets are refreshed before reading, so that traces appended
+        while iterating over the file are picked up.
     :param **kwargs: other kwargs are ignored!
     """
     traces = []
     for tr in iterh5(fname, group=group, readonly=readonly, headonly=headonly,
-                     mode=mode):
+                     mode=mode, starttime=starttime, endtime=endtime,
+                     seed_id=seed_id, pad=pad, fill_value=fill_value,
+                     mmap=mmap, lazy=lazy, swmr=swmr):
         traces.append(tr)
     return Stream(traces=traces)
 
 
+def _readh5(fname, kwargs):
+    return readh5(fname, **kwargs)
+
+
+def iterh5_many(fnames, workers=None, ordered=True, **kwargs):
+    """
+    Iterate over traces in many HDF5 files read in parallel processes.
+
+    :param fnames: iterable of file names
+    :param workers: number of processes, defaults to number of CPUs
+    :param ordered: True (default) yields traces in order of the files,
+        False yields traces of each file as soon as it is read
+    :param **kwargs: passed to readh5, e.g. readonly, headonly
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    fnames = iter(fnames)
+    pending = deque()
+    with ProcessPoolExecutor(workers) as executor:
+        def submit(n):
+            for fname in islice(fnames, n):
+                pending.append(executor.submit(_readh5, fname, kwargs))
+        # limit number of files read in advance
+        submit(2 * workers)
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            submit(len(done))
+            for future in done:
+                for tr in future.result():
+                    yield tr
+
+
+def readh5_many(fnames, workers=None, ordered=True, **kwargs):
+    """
+    Read many HDF5 files in parallel processes and return Stream object.
+
+    See iterh5_many for doc of kwargs.
+    """
+    return Stream(traces=list(iterh5_many(fnames, workers=workers,
+                                          ordered=ordered, **kwargs)))
+
+
+def read_headers(fname, fields=_HEADER_FIELDS, group='/', readonly=None,
+                 starttime=None, endtime=None, seed_id=None, mode='r'):
+    """
+    Read headers of traces in HDF5 file into a structured array.
+
+    This is much faster than readh5(..., headonly=True) for large files,
+    because no Trace objects are created and only the requested headers
+    are decoded.
+
+    :param fname: name of file to read
+    :param fields: headers to read, defaults to
+        ('id', 'starttime', 'endtime', 'sampling_rate', 'npts').
+        Additionally the fields 'path' and 'row' can be used to identify
+        the dataset (and its row for the packed layout).
+        If only these fields are requested, they are read from the header
+        table without accessing any dataset.
+    :param group, readonly, starttime, endtime, seed_id, mode:
+        select traces, see readh5
+    :return: numpy structured array with one row per trace,
+        UTCDateTime headers are returned as datetime64[ns]
+    """
+    with _open(fname, mode) as f:
+        return _read_headers(f, tuple(fields), group=group, readonly=readonly,
+                             starttime=starttime, endtime=endtime,
+                             seed_id=seed_id)
+
+
+def _read_headers(f, fields, group='/', readonly=None, starttime=None,
+                  endtime=None, seed_id=None):
+    """Read headers of traces in opened file, see read_headers."""
+    group, levels = _select_group(f, group, readonly)
+    filters = (starttime is not None or endtime is not None or
+               seed_id is not None)
+    table = _read_header_table(f, group, levels=levels)
+    if table is not None and set(fields) <= set(_header_dtype().names):
+        table = _filter_headers(table, starttime=starttime,
+                                endtime=endtime, seed_id=seed_id)
+        columns = {field: table[field] for field in fields}
+        for field in ('starttime', 'endtime'):
+            if field in columns:
+                columns[field] = columns[field].astype('datetime64[ns]')
+        for field in ('id', 'path'):
+            if field in columns:
+                columns[field] = np.char.decode(
+                    columns[field].astype(bytes), 'utf-8')
+        return _columns2array(columns, fields)
+    if filters:
+        if table is None:
+            table = _scan_headers(group, levels)
+        table = _filter_headers(table, starttime=starttime,
+                                endtime=endtime, seed_id=seed_id)
+        entries = [(f[path], row if row >= 0 else None)
+                   for path, row in zip(table['path'].astype(str),
+                                        table['row'])
+                   if path in f]
+    else:
+        entries = []
+        for dataset in _walk(group, levels):
+            if _is_packed(dataset):
+                entries.extend((dataset, row)
+                               for row in _packed_rows(dataset, levels))
+            else:
+                entries.append((dataset, None))
+    return _read_header_fields(entries, fields)
+
+
+def read_array(fname, group='/', readonly=None, starttime=None,
+               endtime=None, seed_id=None, dtype=None,
+               fields=_HEADER_FIELDS, mode='r'):
+    """
+    Read data of traces with equal length into one 2D array.
+
+    The data of all selected traces is read directly into a preallocated
+    array, no Trace objects are created. Useful for stacking or
+    beamforming of many traces.
+
+    :param fname: name of file to read
+    :param group, readonly, seed_id, mode: select traces, see readh5
+    :param starttime, endtime: select traces and read only samples inside
+        this time window, see readh5
+    :param dtype: data type of the array (e.g. 'float32'),
+        defaults to the data type of the datasets
+    :param fields: headers to read, see read_headers.
+        starttime, endtime and npts describe the returned samples.
+    :return: tuple of data array with one row per trace and
+        structured array with headers of these traces
+    :raises ValueError: if the number of samples differ between traces
+    """
+    fields = tuple(fields)
+    window = starttime is not None or endtime is not None
+    needed = ('path', 'row', 'npts')
+    if window:
+        needed = needed + ('starttime', 'sampling_rate')
+    with _open(fname, mode) as f:
+        headers = _read_headers(
+            f, tuple(dict.fromkeys(fields + needed)), group=group,
+            readonly=readonly, starttime=starttime, endtime=endtime,
+            seed_id=seed_id)
+        npts = headers['npts'].astype('i8')
+        i0 = np.zeros(len(headers), dtype='i8')
+        i1 = npts
+        if window:
+            t0 = headers['starttime'].astype('i8')
+            sr = headers['sampling_rate']
+            # round to the nearest sample like _sample_window
+            if starttime is not None:
+                i0 = np.floor((UTC(starttime).ns - t0) / 1e9 * sr + 0.5)
+            if endtime is not None:
+                i1 = npts - np.floor(
+                    (t0 - UTC(endtime).ns) / 1e9 * sr + npts - 1 + 0.5)
+            i0 = np.clip(i0, 0, npts).astype('i8')
+            i1 = np.clip(i1, i0, npts).astype('i8')
+        lengths = np.unique(i1 - i0)
+        if len(lengths) > 1:
+            msg = ('Traces have different number of samples (%s), use readh5'
+                   % ', '.join(str(n) for n in lengths))
+            raise ValueError(msg)
+        n = lengths[0] if len(lengths) > 0 else 0
+        datasets = {path: f[path] for path in np.unique(headers['path'])}
+        if dtype is None:
+            dtypes = [np.dtype(dataset.attrs.get('_dtype', dataset.dtype))
+                      for dataset in datasets.values()]
+            dtype = np.result_type(*dtypes) if len(dtypes) > 0 else 'f8'
+        data = np.empty((len(headers), n), dtype=dtype)
+        if n > 0:
+            for k, (path, row) in enumerate(zip(headers['path'],
+                                                headers['row'])):
+                if row < 0:
+                    sel = np.s_[i0[k]:i1[k]]
+                else:
+                    sel = np.s_[row, i0[k]:i1[k]]
+                datasets[path].read_direct(data, sel, np.s_[k])
+                if _PROFILES:
+                    _count('bytes_read', n * data.itemsize)
+    columns = {field: headers[field] for field in fields}
+    if window:
+        start = headers['starttime'] + np.round(
+            i0 / sr * 1e9).astype('timedelta64[ns]')
+        if 'starttime' in fields:
+            columns['starttime'] = start
+        if 'endtime' in fields:
+            columns['endtime'] = start + np.round(
+                max(n - 1, 0) / sr * 1e9).astype('timedelta64[ns]')
+        if 'npts' in fields:
+            columns['npts'] = np.full(len(headers), n)
+    return data, _columns2array(columns, fields)
+
+
+_HEADER_DEFAULTS = {'network': '', 'station': '', 'location': '',
+                    'channel': '', 'delta': 1.0, 'calib': 1.0,
+                    'starttime': '1970-01-01T00:00:00.000000Z'}
+
+
+def _read_header_fields(entries, fields):
+    """Read and decode requested headers of (dataset, row) entries."""
+    raw = []
+    for field in fields:
+        if field == 'id':
+            raw.extend(('network', 'station', 'location', 'channel'))
+        elif field == 'endtime':
+            raw.extend(('starttime', 'delta', 'npts'))
+        elif field == 'sampling_rate':
+            raw.append('delta')
+        else:
+            raw.append(field)
+    raw = list(dict.fromkeys(raw))
+    values = {key: [] for key in raw}
+    packed = {}
+    for dataset, row in entries:
+        if row is None:
+            attrs = dataset.attrs
+            jsondata = None
+            if '_header' in attrs:
+                attrs = dict(attrs)
+                attrs.update(_compact_fields(attrs.pop('_header')))
+        else:
+            if dataset.name not in packed:
+                headers = dataset.file[dataset.name + _PACKED_HEADERS]
+                packed[dataset.name] = headers['header']
+            attrs = json.loads(packed[dataset.name][row])
+        for key in raw:
+            if key == 'npts':
+                val = dataset.shape[-1]
+            elif key == 'path':
+                val = dataset.name
+            elif key == 'row':
+                val = -1 if row is None else row
+            elif key in attrs:
+                val = attrs[key]
+            elif row is None and '_json' in attrs:
+                if jsondata is None:
+                    jsondata = json.loads(attrs['_json'],
+                                          object_hook=_json_hook)
+                val = jsondata.get(key, _HEADER_DEFAULTS.get(key))
+            else:
+                val = _HEADER_DEFAULTS.get(key)
+            if isinstance(val, bytes):
+                val = val.decode('utf-8')
+            values[key].append(val)
+    columns = {key: _header_column(vals) for key, vals in values.items()}
+    if 'starttime' in columns and len(entries) == 0:
+        columns['starttime'] = columns['starttime'].astype('datetime64[ns]')
+    out = {}
+    for field in fields:
+        if field == 'id':
+            col = columns['network']
+            for key in ('station', 'location', 'channel'):
+                col = np.char.add(np.char.add(col.astype(str), '.'),
+                                  columns[key].astype(str))
+            out[field] = col
+        elif field == 'endtime':
+            duration = np.round(columns['delta'] * 1e9 *
+                                np.maximum(columns['npts'] - 1, 0))
+            out[field] = (columns['starttime'] +
+                          duration.astype('timedelta64[ns]'))
+        elif field == 'sampling_rate':
+            out[field] = 1.0 / columns['delta']
+        else:
+            out[field] = columns[field]
+    return _columns2array(out, fields)
+
+
+def _header_column(vals):
+    """Convert header values to array, UTCDateTime objects and strings are
+    converted to datetime64 in bulk, missing values to NaT."""
+    if any(isinstance(v, UTC) for v in vals):
+        if all(v is None or isinstance(v, UTC) for v in vals):
+            # written by the compact codec, no parsing needed
+            times = np.full(len(vals), np.datetime64('NaT'), 'datetime64[ns]')
+            valid = np.array([v is not None for v in vals], dtype=bool)
+            times[valid] = np.array([v.ns for v in vals if v is not None],
+                                    dtype='i8').astype('datetime64[ns]')
+            return times
+        vals = [str(v) if isinstance(v, UTC) else v for v in vals]
+    if any(v is None or isinstance(v, (list, tuple, dict, np.ndarray))
+           for v in vals):
+        col = np.empty(len(vals), dtype=object)
+        for i, v in enumerate(vals):
+            col[i] = v
+    else:
+        col = np.array(vals)
+    if col.dtype.kind not in 'UO' or len(col) == 0:
+        return col
+    valid = np.array([v is not None for v in col], dtype=bool)
+    if not np.any(valid):
+        return col
+    if not all(isinstance(v, str) for v in col[valid]):
+        return col
+    strs = col[valid].astype(str)
+    if (np.all(np.char.str_len(strs) == 27) and
+            np.all(np.char.endswith(strs, 'Z'))):
+        times = np.full(len(col), np.datetime64('NaT'), 'datetime64[ns]')
+        times[valid] = np.char.rstrip(strs, 'Z').astype('datetime64[ns]')
+        return times
+    return col
+
+
+def _columns2array(columns, fields):
+    """Combine columns to a structured array."""
+    n = len(columns[fields[0]]) if len(fields) > 0 else 0
+    cols = []
+    for field in fields:
+        cols.append(np.asarray(columns[field]))
+    dtype = [(field, col.dtype) for field, col in zip(fields, cols)]
+    array = np.empty(n, dtype=dtype)
+    for field, col in zip(fields, cols):
+        array[field] = col
+    return array
+
+
 def writeh5(stream, fname, mode='w', override='warn',
-            ignore=(), group='/', libver='earliest',
-            **kwargs):
+            ignore=(), group='/', libver='earliest', layout='dataset',
+            compression_workers=None, continuous=False,
+            header_codec='attrs', **kwargs):
     """
     Write stream to HDF5 file.
 
@@ -179,8 +1097,15 @@ def writeh5(stream, fname, mode='w', override='warn',
         file. 'w' will create a new empty file in any case.
     :param override: 'warn' (default, warn and override), 'raise' (raise
         Exception), 'ignore' (override, without warning), 'dont' (do not
-        override, without warning).
+        override, without warning), 'if-changed' (override, if data or
+        headers changed).
         Behaviour if dataset with the same index already exists.
+        With 'if-changed' a hash of data and headers is stored in the
+        attribute '_hash' and compared to the hash of the trace to write,
+        existing datasets without hash are overridden. If the index
+        contains the trace number, traces with the same id, start and end
+        time are looked up in the header table instead. Use repack to
+        reclaim the space of overridden datasets.
     :param ignore: iterable
         Do not write headers listed inside ignore. Additionally the headers
         'endtime', 'sampling_rate', 'npts' and '_format' are ignored.
@@ -189,48 +1114,795 @@ def writeh5(stream, fname, mode='w', override='warn',
     :param libver: hdf5 version bounding for new files,
         `'latest'` for best performance,
         `'earliest'` for best backwards compatibility (default)
+    :param layout: 'dataset' (default, one dataset per trace) or 'packed'.
+        With the packed layout traces with the same group and length are
+        appended as rows to a single 2D dataset, the headers are stored as
+        rows of a parallel table. This considerably reduces file size and
+        metadata overhead for many short traces, e.g. cross-correlations.
+        The index only determines the group of the trace, override is
+        ignored. Headers are serialized to JSON.
+        Files with both layouts are read transparently.
+    :param compression_workers: number of threads used to compress the
+        chunks of each dataset for compression='gzip'.
+        Compressed chunks are written directly to the file, it stays
+        readable with the standard HDF5 filters.
+    :param continuous: append traces continuing an existing dataset of the
+        same id to this dataset, see H5Writer
+    :param header_codec: 'attrs' (default, one attribute per header) or
+        'compact'. The compact codec stores network, station, location,
+        channel, starttime (as nanoseconds), delta and calib in one compound
+        attribute and the remaining headers as JSON with tagged UTCDateTime
+        objects. This speeds up writing and reading of headers.
+        Both codecs are detected automatically when reading.
+        Only used for the dataset layout.
     :param **kwargs: Additional kwargs are passed to create_dataset in h5py.
         :param dtype: Data will be converted to this datatype
-        :param compression: Compression filter (e.g. 'gzip', 'lzf')
+        :param compression: Compression filter (e.g. 'gzip', 'lzf') or
+            'auto' (select lossless filters for each trace, see below)
         :param scaleoffset: Precission filter (integer number,
             for integer data: number of bits, for float data: number of digits
             after the decimal point)
         For other kwargs consult the documentation of h5py.
 
+    With compression='auto' the filter pipelines 'none', 'lzf' (with
+    shuffle), 'scaleoffset' (lossless, integer data only, with gzip) and
+    'gzip' (with shuffle) are tried on a sample of each trace. The fastest
+    pipeline (in this order) is used, whose size exceeds the smallest size
+    by at most a tolerance. Data is downcast to a smaller data type if the
+    values are preserved exactly (e.g. float64 to float32).
+    The data type of the data or given by dtype is restored when reading.
+    The policy can be configured with a dict passed as compression_opts
+    with the keys 'tolerance' (relative size, default 0.1, 0 selects the
+    smallest size), 'downcast' (default True), 'candidates' (names of
+    pipelines, 'none' is used for float data if only 'scaleoffset' is
+    given) and 'sample' (number of samples, default 16384).
+    Only supported for the dataset layout without continuous mode.
+
     Most headers are supported, e.g. numbers, strings, UTCDateTime,
     AttribDict, numpy arrays, lists, tuples (will be converted to lists).
     """
-    if not splitext(fname)[1]:
-        fname = fname + '.h5'
-    with h5py.File(fname, mode, libver=libver) as f:
+    with H5Writer(fname, mode=mode, override=override, ignore=ignore,
+                  group=group, libver=libver, layout=layout,
+                  compression_workers=compression_workers,
+                  continuous=continuous, header_codec=header_codec,
+                  **kwargs) as writer:
+        writer.write(stream)
+
+
+class H5Writer(object):
+    """
+    Writer session keeping a HDF5 file open for writing many traces.
+
+    The file, its index and the group are resolved only once.
+    The trace counter and the header table are updated on flush.
+    Use it as a context manager, e.g. for a real-time ingestion::
+
+        with H5Writer('archive.h5') as writer:
+            for stream in stream_source:
+                writer.write(stream)
+
+    :param fname: filename
+    :param mode: 'a' (append, default), 'w' (write) or other.
+        Argument is passed to h5py.File.
+    :param flush_every: flush after this number of written traces
+    :param flush_interval: flush on write if the last flush is longer ago
+        than this number of seconds
+    :param compression_workers: compress chunks in this number of threads,
+        only used for gzip compression of the dataset layout
+    :param continuous: append traces continuing the last written trace
+        with the same id to its dataset instead of creating a new dataset.
+        A new dataset is started at gaps, overlaps and changes of sampling
+        rate, data type or other headers (except starttime and processing).
+        Datasets are resizable and chunked.
+        The name of extended datasets and the header table are updated on
+        flush (the name is kept in SWMR mode).
+    :param gap_tolerance: maximal allowed deviation of the start time of
+        a continuing trace in samples, defaults to 0.5
+    :param swmr: switch the file to single-writer/multiple-reader mode
+        after the first flush, implies libver='latest'.
+        Readers can then read the file with readh5/iterh5(..., swmr=True)
+        while the writer is appending.
+        Older versions of HDF5 (< 2.0) do not allow to create new datasets
+        in SWMR mode. With these, use the packed layout and make sure that
+        the first flush creates all needed datasets
+        (i.e. it includes traces with all ids and lengths).
+    :param override, ignore, group, libver, layout, header_codec, **kwargs:
+        see writeh5
+    """
+
+    def __init__(self, fname, mode='a', override='warn', ignore=(),
+                 group='/', libver='earliest', layout='dataset',
+                 flush_every=None, flush_interval=None,
+                 compression_workers=None, continuous=False,
+                 gap_tolerance=0.5, swmr=False, header_codec='attrs',
+                 **kwargs):
+        if not splitext(fname)[1]:
+            fname = fname + '.h5'
+        _check_override(override)
+        if layout not in ('dataset', 'packed'):
+            raise ValueError(
+                "Layout has to be one of ('dataset', 'packed').")
+        if continuous and layout != 'dataset':
+            raise ValueError('Continuous mode needs the dataset layout.')
+        if kwargs.get('compression') == 'auto' and (
+                continuous or layout != 'dataset'):
+            raise ValueError("compression='auto' needs the dataset layout "
+                             "without continuous mode.")
+        if kwargs.get('compression') == 'auto':
+            _check_auto_opts(kwargs.get('compression_opts'))
+        if header_codec not in _HEADER_CODECS:
+            raise ValueError(
+                "Header codec has to be one of ('attrs', 'compact').")
+        self.override = override
+        self.ignore = ignore
+        self.layout = layout
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.swmr = swmr
+        self.continuous = continuous
+        self.gap_tolerance = gap_tolerance
+        self.header_codec = header_codec
+        self.kwargs = kwargs
+        self.pool = None
+        if compression_workers:
+            self.pool = ThreadPoolExecutor(compression_workers)
+        if swmr:
+            libver = 'latest'
+        _evict(fname)
+        with _timer('open'):
+            self.file = f = h5py.File(fname, mode, libver=libver)
+        if _PROFILES:
+            _count('files_opened')
         f.attrs['file_format'] = 'obspyh5'
         f.attrs['version'] = __version__
         if 'index' not in f.attrs:
             f.attrs['index'] = _INDEX
         if 'offset_trc_num' not in f.attrs:
+            # new file, create the header table
             f.attrs['offset_trc_num'] = 0
-        trc_num = f.attrs['offset_trc_num']
-        group = f.require_group(group)
+            f.create_dataset(_HEADER_TABLE, (0,), dtype=_header_dtype(),
+                             maxshape=(None,), chunks=(1024,))
+        self.index = f.attrs['index']
+        self.trc_num = int(f.attrs['offset_trc_num'])
+        self._lookup = None
+        if override == 'if-changed':
+            self._lookup = _trace_lookup(f, self.index)
+        self.group = f.require_group(group)
+        self._rows = []
+        self._packed = {}
+        self._segments = {}
+        self._dirty = []
+        self._last_rows = None
+        self._unflushed = 0
+        self._last_flush = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, stream):
+        """Write trace or stream."""
+        if isinstance(stream, Trace):
+            stream = [stream]
         for tr in stream:
-            trace2group(tr, group, override=override,
-                        ignore=ignore, trc_num=trc_num, **kwargs)
-            trc_num += 1
-            f.attrs['offset_trc_num'] = trc_num
+            if self.layout == 'packed':
+                path = _packed_path(tr, self.index, self.trc_num,
+                                    self.kwargs.get('dtype', tr.data.dtype))
+                self._packed.setdefault(path, []).append(tr)
+            elif self.continuous:
+                self._write_continuous(tr)
+            else:
+                dataset = _write_trace(
+                    tr, self.group, self.index, override=self.override,
+                    ignore=self.ignore, trc_num=self.trc_num,
+                    pool=self.pool, header_codec=self.header_codec,
+                    lookup=self._lookup, **self.kwargs)
+                if dataset is not None:
+                    self._rows.append(_header_row(tr, dataset))
+            self.trc_num += 1
+            self._unflushed += 1
+        if ((self.flush_every is not None and
+                self._unflushed >= self.flush_every) or
+                (self.flush_interval is not None and
+                 time.time() - self._last_flush >= self.flush_interval)):
+            self.flush()
+
+    def _segment(self, seed_id):
+        """Return last segment with seed_id, load it from file if needed."""
+        if self._last_rows is None:
+            # index of last row of each id in the header table
+            self._last_rows = {}
+            if _HEADER_TABLE in self.file:
+                table = self.file[_HEADER_TABLE].fields(
+                    ['id', 'endtime', 'row'])[()]
+                ind = np.nonzero(table['row'] < 0)[0]
+                ind = ind[np.argsort(table['endtime'][ind], kind='stable')]
+                for i in ind:
+                    self._last_rows[table['id'][i].decode('utf-8')] = i
+        if seed_id in self._segments:
+            return self._segments[seed_id]
+        i = self._last_rows.pop(seed_id, None)
+        if i is None:
+            return
+        path = self.file[_HEADER_TABLE][i]['path'].decode('utf-8')
+        if path not in self.file:
+            return
+        dataset = self.file[path]
+        stats = Trace(header=_decode_attrs(dataset.attrs)).stats
+        trc_num = _trc_num(self.index,
+                           posixpath.relpath(path, self.group.name))
+        seg = {'dataset': dataset, 'stats': stats, 'npts': len(dataset),
+               'headers': self._static_headers(Trace(header=stats)),
+               'trc_num': trc_num, 'table_index': i, 'dirty': False}
+        self._segments[seed_id] = seg
+        return seg
+
+    def _static_headers(self, trace):
+        """Return headers which have to match along a segment as JSON."""
+        ignore = tuple(self.ignore) + ('starttime', 'processing')
+        headers = dict(_header_items(trace, ignore, utc2str=False))
+        return json.dumps(headers, cls=_SegmentEncoder, sort_keys=True)
+
+    def _write_continuous(self, trace):
+        """
+        Append trace to the last segment or start a new segment.
+
+        A new segment is started after a gap or if the data type or other
+        headers than the start time and processing differ from the last
+        segment.
+        """
+        seg = self._segment(trace.id)
+        data = trace.data
+        if seg is not None:
+            dataset = seg['dataset']
+            stats = seg['stats']
+            dtype = np.dtype(self.kwargs.get('dtype', data.dtype))
+            gap = (trace.stats.starttime - stats.starttime -
+                   seg['npts'] * stats.delta)
+            if (dataset.maxshape[0] is None and dataset.dtype == dtype and
+                    stats.sampling_rate == trace.stats.sampling_rate and
+                    abs(gap) <= self.gap_tolerance * stats.delta and
+                    seg['headers'] == self._static_headers(trace)):
+                n = seg['npts']
+                with _timer('write_data'):
+                    dataset.resize((n + len(data),))
+                    dataset[n:] = data
+                if _PROFILES:
+                    _count('traces_written')
+                    _count('bytes_written', len(data) * dtype.itemsize)
+                seg['npts'] = n + len(data)
+                if not seg['dirty']:
+                    seg['dirty'] = True
+                    self._dirty.append(seg)
+                return
+        kwargs = dict(self.kwargs)
+        kwargs.setdefault('chunks', True)
+        kwargs['maxshape'] = (None,)
+        dataset = _write_trace(trace, self.group, self.index,
+                               override=self.override, ignore=self.ignore,
+                               trc_num=self.trc_num, pool=self.pool,
+                               header_codec=self.header_codec, **kwargs)
+        if dataset is not None:
+            seg = {'dataset': dataset, 'stats': trace.stats.copy(),
+                   'npts': len(data), 'headers': self._static_headers(trace),
+                   'trc_num': self.trc_num, 'table_index': None,
+                   'dirty': True}
+            self._segments[trace.id] = seg
+            self._dirty.append(seg)
+
+    def _flush_segments(self):
+        """Rename extended datasets and update their header table rows."""
+        rows = []
+        for seg in self._dirty:
+            stats = seg['stats'].copy()
+            stats.npts = seg['npts']
+            trace = Trace(header=stats)
+            dataset = seg['dataset']
+            if not self.swmr:
+                path = posixpath.join(self.group.name, _format_index(
+                    self.index, trace, seg['trc_num']))
+                if path != dataset.name and path not in self.file:
+                    self.file.move(dataset.name, path)
+                    dataset = seg['dataset'] = self.file[path]
+            row = _header_row(trace, dataset)
+            if _HEADER_TABLE in self.file:
+                table = self.file[_HEADER_TABLE]
+                if seg['table_index'] is None:
+                    seg['table_index'] = len(table) + len(rows)
+                    rows.append(row)
+                else:
+                    table[seg['table_index']] = np.array(row,
+                                                         dtype=table.dtype)
+            seg['dirty'] = False
+        self._dirty = []
+        _append_header_rows(self.file, rows)
+
+    def flush(self):
+        """Write buffered traces and headers and flush file to disk."""
+        for path, traces in self._packed.items():
+            self._rows.extend(_write_packed(
+                traces, self.group, path, ignore=self.ignore, **self.kwargs))
+        self._packed = {}
+        with _timer('flush'):
+            _append_header_rows(self.file, self._rows)
+            self._rows = []
+            self._flush_segments()
+            self.file.attrs['offset_trc_num'] = self.trc_num
+            self.file.flush()
+        if self.swmr and not self.file.swmr_mode:
+            self.file.swmr_mode = True
+        self._unflushed = 0
+        self._last_flush = time.time()
+
+    def close(self):
+        """Flush and close file."""
+        if self.file:
+            self.flush()
+            self.file.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+class ParallelH5Writer(object):
+    """
+    Write traces submitted by many processes in a single writer process.
+
+    The writer process owns the file and writes the traces with H5Writer,
+    which allocates the trace numbers and batches the header table updates.
+    Traces are submitted over a bounded queue, write blocks while the queue
+    is full. On POSIX systems data arrays of at least shm_threshold bytes
+    are passed in shared memory, otherwise data is passed over the queue.
+    The writer object can be passed to worker processes::
+
+        def process(writer, fname):
+            writer.write(do_something(read(fname)))
+
+        with ParallelH5Writer('out.h5') as writer:
+            with ProcessPoolExecutor() as pool:
+                list(pool.map(process, [writer] * len(fnames), fnames))
+
+    :param fname: filename
+    :param maxsize: maximal number of traces in the queue
+    :param shm_threshold: pass data arrays with at least this number of
+        bytes in shared memory, only used on POSIX systems
+    :param **kwargs: passed to H5Writer, e.g. mode, layout or flush_every
+    """
+
+    def __init__(self, fname, maxsize=100, shm_threshold=2 ** 16,
+                 **kwargs):
+        self.shm_threshold = shm_threshold
+        self._manager = multiprocessing.Manager()
+        self.queue = self._manager.Queue(maxsize)
+        self._errors = self._manager.Queue()
+        self.process = multiprocessing.Process(
+            target=_parallel_write,
+            args=(fname, self.queue, self._errors, kwargs))
+        self.process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # copies in other processes can only submit traces
+        return {'shm_threshold': self.shm_threshold, 'queue': self.queue,
+                '_errors': None, '_manager': None, 'process': None}
+
+    def write(self, stream):
+        """Submit trace or stream for writing."""
+        if isinstance(stream, Trace):
+            stream = [stream]
+        for tr in stream:
+            self.queue.put(_pack_trace(tr, self.shm_threshold))
+
+    def close(self):
+        """
+        Wait until all submitted traces are written and close file.
+
+        Can only be called in the process which created the writer.
+        """
+        if self.process is None:
+            raise RuntimeError('Writer can only be closed by its creator.')
+        if self._manager is None:
+            return
+        self.queue.put(None)
+        self.process.join()
+        errors = []
+        while not self._errors.empty():
+            errors.append(self._errors.get())
+        self._manager.shutdown()
+        self._manager = None
+        if self.process.exitcode != 0 and len(errors) == 0:
+            errors.append('exit code %d' % self.process.exitcode)
+        if len(errors) > 0:
+            raise RuntimeError('Writer process failed: ' + '; '.join(errors))
+
+
+def _create_shm(size):
+    """Create shared memory which is unlinked by the writer process."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(create=True, size=size,
+                                          track=False)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _pack_trace(trace, shm_threshold):
+    """Return picklable item for the queue, large data in shared memory."""
+    data = np.ascontiguousarray(trace.data)
+    # named shared memory outlives the handle of its creator only on POSIX
+    if data.nbytes < shm_threshold or os.name != 'posix':
+        return trace.stats, data
+    shm = _create_shm(data.nbytes)
+    np.ndarray(data.shape, data.dtype, buffer=shm.buf)[:] = data
+    item = trace.stats, (shm.name, data.shape, data.dtype.str)
+    shm.close()
+    return item
+
+
+def _unpack_trace(item):
+    """Return trace from item of the queue, release shared memory."""
+    stats, data = item
+    if isinstance(data, tuple):
+        name, shape, dtype = data
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            data = np.array(np.ndarray(shape, dtype, buffer=shm.buf))
+        finally:
+            shm.close()
+            shm.unlink()
+    return Trace(data=data, header=stats)
+
+
+def _parallel_write(fname, queue, errors, kwargs):
+    """Target of the writer process of ParallelH5Writer."""
+    writer = None
+    try:
+        writer = H5Writer(fname, **kwargs)
+    except Exception as ex:
+        errors.put(repr(ex))
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        try:
+            trace = _unpack_trace(item)
+            if writer is not None:
+                writer.write(trace)
+        except Exception as ex:
+            # keep draining the queue, so that producers do not block
+            errors.put(repr(ex))
+    if writer is not None:
+        try:
+            writer.close()
+        except Exception as ex:
+            errors.put(repr(ex))
+
+
+def _trace_lookup(f, index):
+    """
+    Return dict mapping id, start and end time to paths of datasets.
+
+    Used by override='if-changed' to find written traces if the index
+    contains the running trace number. Returns None for other indexes.
+    """
+    if '{trc_num' not in index:
+        return None
+    lookup = {}
+    if _HEADER_TABLE in f:
+        table = f[_HEADER_TABLE].fields(
+            ['id', 'starttime', 'endtime', 'path', 'row'])[()]
+        for row in table[table['row'] < 0]:
+            key = (row['id'].decode('utf-8'), int(row['starttime']),
+                   int(row['endtime']))
+            lookup[key] = row['path'].decode('utf-8')
+    return lookup
+
+
+def _check_override(override):
+    if override not in ('warn', 'raise', 'ignore', 'dont', 'if-changed'):
+        msg = ("Override has to be one of ('warn', 'raise', 'ignore', "
+               "'dont', 'if-changed').")
+        raise ValueError(msg)
 
 
 def trace2group(trace, group, override='warn', ignore=(),
                 trc_num=0, **kwargs):
     """Write trace into group."""
-    if override not in ('warn', 'raise', 'ignore', 'dont'):
-        msg = "Override has to be one of ('warn', 'raise', 'ignore', 'dont')."
-        raise ValueError(msg)
+    _check_override(override)
     try:
         index = group.file.attrs['index']
     except KeyError:
         index = group.file.attrs['index'] = _INDEX
-    duration = trace.stats.endtime - trace.stats.starttime
-    index = index.format(trc_num=trc_num, id=trace.id, duration=duration,
-                         **trace.stats)
+    lookup = None
+    if override == 'if-changed':
+        lookup = _trace_lookup(group.file, index)
+    dataset = _write_trace(trace, group, index, override=override,
+                           ignore=ignore, trc_num=trc_num, lookup=lookup,
+                           **kwargs)
+    if dataset is not None:
+        _append_header_rows(group.file, [_header_row(trace, dataset)])
+
+
+def consolidate(fnames, master, group='/'):
+    """
+    Link traces of many files into a master file of virtual datasets.
+
+    Each dataset in the source files is linked by a HDF5 virtual dataset
+    with the same headers. Its path is given by the index of the master
+    file, which is taken from the first source file for new master files.
+    Rows of packed datasets with the same path are concatenated.
+    No sample data is copied, the source files have to stay accessible.
+    They are referenced relative to the master file if possible.
+    The master file is read like any other file, e.g. with
+    readh5(master, readonly=...).
+
+    Files already linked into the master file are skipped. Call consolidate
+    with all files again when new files arrive to refresh the master file.
+
+    :param fnames: filenames of source files
+    :param master: filename of master file, created if it does not exist
+    :param group: group of the source files to link, defaults to '/'
+    :return: list of newly linked files
+    """
+    if isinstance(fnames, str):
+        fnames = [fnames]
+    if not splitext(master)[1]:
+        master = master + '.h5'
+    index = None
+    if not os.path.exists(master) and len(fnames) > 0:
+        with _open(fnames[0]) as f:
+            index = f.attrs.get('index', _INDEX)
+    root = os.path.dirname(os.path.abspath(master))
+    added = []
+    with H5Writer(master, mode='a') as writer:
+        f = writer.file
+        if index is not None:
+            f.attrs['index'] = writer.index = index
+        if _SOURCES not in f:
+            f.create_dataset(_SOURCES, (0,), dtype=h5py.string_dtype(),
+                             maxshape=(None,), chunks=(256,))
+        linked = {src.decode('utf-8') if isinstance(src, bytes) else src
+                  for src in f[_SOURCES][()]}
+        for fname in fnames:
+            try:
+                src = os.path.relpath(os.path.abspath(fname), root)
+            except ValueError:
+                # different drives on Windows
+                src = os.path.abspath(fname)
+            if src in linked:
+                continue
+            with _open(fname) as fsrc:
+                sgroup = fsrc[group]
+                for dataset in _walk(sgroup):
+                    if _is_packed(dataset):
+                        path = posixpath.relpath(dataset.name, sgroup.name)
+                        _link_packed(writer, dataset, src, path)
+                    else:
+                        _link_dataset(writer, dataset, src)
+            _append_rows(f[_SOURCES], [src])
+            linked.add(src)
+            added.append(fname)
+    return added
+
+
+def _link_dataset(writer, dataset, src):
+    """Link dataset of file src into the file of writer."""
+    stats = _decode_attrs(dataset.attrs)
+    stats['npts'] = len(dataset)
+    trace = Trace(header=stats)
+    try:
+        path = _format_index(writer.index, trace, writer.trc_num)
+    except (KeyError, AttributeError, IndexError, ValueError):
+        path = dataset.name.lstrip('/')
+    if path in writer.group:
+        warn("Index '%s' already exists. Will not link trace." % path)
+        return
+    layout = h5py.VirtualLayout(dataset.shape, dataset.dtype)
+    if dataset.size > 0:
+        layout[...] = h5py.VirtualSource(src, dataset.name,
+                                         shape=dataset.shape)
+    vds = writer.group.create_virtual_dataset(path, layout)
+    for key, val in dataset.attrs.items():
+        vds.attrs[key] = val
+    writer._rows.append(_header_row(trace, vds))
+    writer.trc_num += 1
+
+
+def _link_packed(writer, dataset, src, path):
+    """Append rows of packed dataset of file src to the virtual dataset."""
+    group = writer.group
+    headers = dataset.file[dataset.name + _PACKED_HEADERS]
+    n = min(len(dataset), len(headers))
+    if n == 0:
+        return
+    npts = dataset.shape[1]
+    sources = []
+    if path in group:
+        old = group[path]
+        if (not old.is_virtual or old.dtype != dataset.dtype or
+                old.shape[1] != npts):
+            warn("Packed dataset '%s' can not be extended." % path)
+            return
+        for vmap in old.virtual_sources():
+            start, end = vmap.vspace.get_select_bounds()
+            sources.append((vmap.file_name, vmap.dset_name,
+                            end[0] - start[0] + 1))
+        vheaders = group[path + _PACKED_HEADERS]
+        del group[path]
+    else:
+        vheaders = group.create_dataset(
+            path + _PACKED_HEADERS, (0,), dtype=_packed_dtype(),
+            maxshape=(None,), chunks=(1024,))
+    sources.append((src, dataset.name, n))
+    nrows = sum(rows for _, _, rows in sources)
+    layout = h5py.VirtualLayout((nrows, npts), dataset.dtype)
+    i = 0
+    for fname, name, rows in sources:
+        layout[i:i + rows] = h5py.VirtualSource(fname, name,
+                                                shape=(rows, npts))
+        i += rows
+    vds = group.create_virtual_dataset(path, layout)
+    start = len(vheaders)
+    table = headers[:n]
+    _append_rows(vheaders, table)
+    writer._rows.extend(
+        tuple(h)[:5] + (vds.name, start + row) for row, h in enumerate(
+            table[['id', 'starttime', 'endtime', 'sampling_rate', 'npts']]))
+    writer.trc_num += n
+
+
+def update_headers(fname, selector=None, updates=None):
+    """
+    Update headers of traces in place without rewriting their data.
+
+    Only the attributes of the matching datasets are rewritten.
+    A dataset is moved if its name given by the index changes,
+    e.g. after changing the station code.
+    The header table is updated accordingly.
+    Traces of the packed layout share their dataset with other traces and
+    are not moved, headers changing the group of such a trace given by the
+    index are not allowed. In this case no trace is updated.
+
+    :param fname: name of file
+    :param selector: dict with arguments of readh5 selecting the traces
+        (group, readonly, starttime, endtime, seed_id),
+        defaults to all traces
+    :param updates: dict with new header values or function called with
+        the stats of each selected trace returning such a dict
+    :return: number of updated traces
+    :raises KeyError: if a dataset should be moved to an existing name
+    :raises ValueError: if a trace of the packed layout would have to be
+        moved to another group
+    """
+    if updates is None:
+        return 0
+    selector = {} if selector is None else selector
+    with _open(fname, 'a') as f:
+        index = f.attrs.get('index', _INDEX)
+        selected = _read_headers(f, ('path', 'row'), **selector)
+        changes = []
+        for path, row in zip(selected['path'], selected['row']):
+            dataset = f[path]
+            if row < 0:
+                stats = _decode_attrs(dataset.attrs)
+            else:
+                headers = f[path + _PACKED_HEADERS]
+                stats = _decode_packed_header(headers[row]['header'])
+            stats['npts'] = dataset.shape[-1]
+            old = Trace(header=stats)
+            new = Trace(header=old.stats.copy())
+            upd = updates(old.stats.copy()) if callable(updates) else updates
+            for key, val in upd.items():
+                new.stats[key] = val
+            if row >= 0 and (
+                    posixpath.dirname(_format_index(index, old, 0)) !=
+                    posixpath.dirname(_format_index(index, new, 0))):
+                msg = ("Trace '%s' of the packed layout can not be moved to "
+                       "another group, update headers of the index of "
+                       "packed traces by rewriting them.") % old.id
+                raise ValueError(msg)
+            changes.append((path, row, dataset, old, new))
+        rows = {}
+        for path, row, dataset, old, new in changes:
+            if row < 0:
+                dataset = _update_dataset(f, dataset, old, new, index)
+                rows[(path, -1)] = _header_row(new, dataset)
+            else:
+                _update_packed_row(f, dataset, row, new)
+                rows[(path, row)] = _header_row(new, dataset, row)
+        if _HEADER_TABLE in f and len(rows) > 0:
+            table = f[_HEADER_TABLE]
+            keys = table.fields(['path', 'row'])[()]
+            for i, (path, row) in enumerate(keys):
+                if isinstance(path, bytes):
+                    path = path.decode('utf-8')
+                if (path, row) in rows:
+                    table[i] = np.array(rows[(path, row)], dtype=table.dtype)
+    return len(rows)
+
+
+def _update_dataset(f, dataset, old, new, index):
+    """Rewrite attributes of dataset and move it if its index changed."""
+    trc_num = _trc_num(index, dataset.name)
+    old_path = _format_index(index, old, trc_num)
+    new_path = _format_index(index, new, trc_num)
+    path = dataset.name
+    if old_path != new_path and path.endswith('/' + old_path):
+        path = path[:-len(old_path)] + new_path
+        if path in f:
+            raise KeyError("Index '%s' already exists." % path)
+        parent = posixpath.dirname(dataset.name)
+        f.move(dataset.name, path)
+        dataset = f[path]
+        # remove empty groups left behind
+        while parent != '/' and len(f[parent]) == 0:
+            del f[parent]
+            parent = posixpath.dirname(parent)
+    compact = '_header' in dataset.attrs
+    # keep attributes describing the stored data, the hash is outdated
+    keep = {key: dataset.attrs[key] for key in ('_codec', '_dtype')
+            if key in dataset.attrs}
+    for key in list(dataset.attrs):
+        del dataset.attrs[key]
+    if compact:
+        _write_compact_header(new, dataset)
+    else:
+        _write_attrs(new, dataset)
+    for key, val in keep.items():
+        dataset.attrs[key] = val
+    return dataset
+
+
+def _update_packed_row(f, dataset, row, new):
+    """Rewrite headers of a trace in a packed dataset."""
+    headers = f[dataset.name + _PACKED_HEADERS]
+    headers[row] = np.array(
+        _header_row(new, dataset)[:5] +
+        (json.dumps(dict(_header_items(new)), cls=_FlexibleEncoder),),
+        dtype=headers.dtype)
+
+
+def _write_trace(trace, group, index, override='warn', ignore=(),
+                 trc_num=0, pool=None, header_codec='attrs', lookup=None,
+                 **kwargs):
+    """
+    Write trace into group and return the created dataset.
+
+    lookup maps id, start and end time to the paths of written traces,
+    see _trace_lookup. With override='if-changed' a trace found in lookup
+    is compared and overridden like a dataset with the same index.
+    """
+    index = _format_index(index, trace, trc_num)
+    kwargs.setdefault('dtype', trace.data.dtype)
+    data = trace.data
+    codec = None
+    # data type requested by the user, restored if data is downcast
+    dtype = np.dtype(kwargs['dtype'])
+    if kwargs.get('compression') == 'auto':
+        kwargs = dict(kwargs)
+        del kwargs['compression']
+        data = np.asarray(data, dtype=kwargs['dtype'])
+        codec, codec_kwargs, data = _auto_codec(
+            data, kwargs.pop('compression_opts', None))
+        kwargs.update(codec_kwargs, dtype=data.dtype)
+    digest = None
+    key = None
+    if override == 'if-changed':
+        digest = _content_hash(trace, ignore, dtype)
+        if lookup is not None:
+            key = (trace.id, trace.stats.starttime.ns,
+                   trace.stats.endtime.ns)
+            path = lookup.get(key)
+            if path is not None and path in group.file:
+                if group.file[path].attrs.get('_hash') == digest:
+                    return
+                del group.file[path]
     if index in group:
         msg = "Index '%s' already exists." % index
         if override == 'warn':
@@ -239,33 +1911,356 @@ def trace2group(trace, group, override='warn', ignore=(),
             raise KeyError(msg)
         elif override == 'dont':
             return
+        elif override == 'if-changed':
+            if group[index].attrs.get('_hash') == digest:
+                return
         del group[index]
-    kwargs.setdefault('dtype', trace.data.dtype)
-    dataset = group.create_dataset(index, trace.data.shape, **kwargs)
-    dataset[:] = trace.data
+    with _timer('write_data'):
+        if pool is not None and _direct_chunks_supported(kwargs, data):
+            kwargs.setdefault('chunks', True)
+            dataset = group.create_dataset(index, data.shape, **kwargs)
+            _write_chunks(dataset, data, pool)
+        else:
+            dataset = group.create_dataset(index, data.shape, **kwargs)
+            dataset[:] = data
+    with _timer('write_attrs'):
+        if header_codec == 'compact':
+            _write_compact_header(trace, dataset, ignore)
+        else:
+            _write_attrs(trace, dataset, ignore)
+        if digest is not None:
+            dataset.attrs['_hash'] = digest
+        if key is not None:
+            lookup[key] = dataset.name
+        if codec is not None:
+            dataset.attrs['_codec'] = codec
+            if data.dtype != dtype:
+                dataset.attrs['_dtype'] = dtype.str
+    if _PROFILES:
+        _count('traces_written')
+        _count('bytes_written', dataset.size * dataset.dtype.itemsize)
+        _count('attrs_written', len(dataset.attrs))
+    return dataset
+
+
+def _downcast(data):
+    """Return data converted to a smaller data type if values are kept."""
+    kind = data.dtype.kind
+    if len(data) == 0:
+        return data
+    if kind == 'f' and data.dtype.itemsize > 4:
+        with np.errstate(over='ignore'):
+            converted = data.astype('float32')
+        if np.array_equal(converted, data, equal_nan=True):
+            return converted
+    elif kind in 'iu':
+        vmin, vmax = data.min(), data.max()
+        for size in (1, 2, 4):
+            if size >= data.dtype.itemsize:
+                break
+            dtype = np.dtype('%s%d' % (kind, size))
+            info = np.iinfo(dtype)
+            if vmin >= info.min and vmax <= info.max:
+                return data.astype(dtype)
+    return data
+
+
+def _check_auto_opts(opts):
+    """Check candidates in compression_opts of compression='auto'."""
+    candidates = (opts or {}).get('candidates', _AUTO_CODECS)
+    if len(candidates) == 0:
+        raise ValueError('No candidates for compression given.')
+    unknown = [name for name in candidates if name not in _AUTO_CODECS]
+    if len(unknown) > 0:
+        msg = 'Unknown compression candidates %s, use some of %s.'
+        raise ValueError(msg % (unknown, tuple(_AUTO_CODECS)))
+
+
+def _auto_codec(data, opts=None):
+    """
+    Select filter pipeline for data by compressing a sample.
+
+    Return name of pipeline, kwargs for create_dataset and data,
+    see writeh5 for the options.
+    """
+    opts = {} if opts is None else opts
+    if opts.get('downcast', True):
+        data = _downcast(data)
+    names = [name for name in opts.get('candidates', _AUTO_CODECS)
+             if name != 'scaleoffset' or data.dtype.kind in 'iu']
+    if len(names) == 0:
+        # only scaleoffset was given for float data
+        names = ['none']
+    sample = data[:opts.get('sample', 2 ** 14)]
+    if len(sample) == 0 or len(names) == 1:
+        return names[0], dict(_AUTO_CODECS[names[0]]), data
+    sizes = []
+    with h5py.File(io.BytesIO(), 'w') as f:
+        for name in names:
+            dataset = f.create_dataset(name, data=sample,
+                                       **_AUTO_CODECS[name])
+            sizes.append(dataset.id.get_storage_size())
+    limit = min(sizes) * (1 + opts.get('tolerance', 0.1))
+    name = [name for name, size in zip(names, sizes) if size <= limit][0]
+    return name, dict(_AUTO_CODECS[name]), data
+
+
+def _content_hash(trace, ignore=(), dtype=None):
+    """Return hash of data and headers of trace."""
+    data = np.ascontiguousarray(trace.data)
+    headers = json.dumps(dict(_header_items(trace, ignore, utc2str=False)),
+                         cls=_HashEncoder, sort_keys=True)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.dtype(dtype or data.dtype).str.encode('utf-8'))
+    h.update(data.dtype.str.encode('utf-8'))
+    h.update(data)
+    h.update(headers.encode('utf-8'))
+    return h.hexdigest()
+
+
+def repack(fname, out=None, libver='earliest'):
+    """
+    Copy all objects into a new file to reclaim unused space.
+
+    HDF5 does not free the space of deleted or overridden datasets.
+    Compressed data is copied without decompression.
+
+    :param fname: name of file
+    :param out: name of the new file, by default fname is replaced
+    :param libver: hdf5 version bounding of the new file, see writeh5
+    """
+    _evict(fname)
+    tmp = fname + '.repack' if out is None else out
+    with h5py.File(fname, 'r') as fin, \
+            h5py.File(tmp, 'w', libver=libver) as fout:
+        for key, val in fin.attrs.items():
+            fout.attrs[key] = val
+        for name in fin:
+            fin.copy(fin[name], fout, name=name)
+    if out is None:
+        os.replace(tmp, fname)
+
+
+def _write_attrs(trace, dataset, ignore=()):
+    """Write headers as attributes, others as JSON attribute '_json'."""
+    jsondata = {}
+    for key, val in _header_items(trace, ignore):
+        if isinstance(val, (tuple, list, AttribDict)):
+            jsondata[key] = val
+        else:
+            try:
+                dataset.attrs[key] = val
+            except (KeyError, TypeError):
+                jsondata[key] = val
+    if len(jsondata) > 0:
+        dataset.attrs['_json'] = json.dumps(jsondata, cls=_FlexibleEncoder)
+
+
+def _write_compact_header(trace, dataset, ignore=()):
+    """
+    Write headers with the compact codec.
+
+    Common headers are stored in one compound attribute '_header' with the
+    start time as nanoseconds, numpy values as attributes and all other
+    headers in the JSON attribute '_json' with tagged UTCDateTime objects.
+    Ignored common headers are stored with their default values, which
+    are also used by Trace for missing headers.
+    """
+    header = dict(trace.stats)
+    for key in _COMPACT_FIELDS:
+        if key in ignore:
+            header[key] = _HEADER_DEFAULTS[key]
+    dataset.attrs['_header'] = np.array(
+        tuple(UTC(header[key]).ns if key == 'starttime' else header[key]
+              for key in _COMPACT_FIELDS),
+        dtype=_compact_dtype())
+    jsondata = {}
+    for key, val in _header_items(trace, ignore, utc2str=False):
+        if key in _COMPACT_FIELDS:
+            continue
+        if isinstance(val, (np.ndarray, np.generic, bytes)):
+            dataset.attrs[key] = val
+        else:
+            jsondata[key] = val
+    if len(jsondata) > 0:
+        dataset.attrs['_json'] = json.dumps(jsondata, cls=_TaggedEncoder)
+
+
+def _direct_chunks_supported(kwargs, data):
+    """Check if chunks can be compressed by obspyh5 itself."""
+    compression = kwargs.get('compression')
+    return (len(data) > 0 and
+            (compression == 'gzip' or
+             isinstance(compression, int) and compression is not True) and
+            kwargs.get('chunks') is not False and
+            not kwargs.get('scaleoffset') and
+            not kwargs.get('fletcher32'))
+
+
+def _compress_chunk(chunk, shuffle, level):
+    """Apply shuffle and deflate filter like HDF5 to a chunk."""
+    if shuffle and chunk.dtype.itemsize > 1:
+        chunk = chunk.view(np.uint8).reshape(-1, chunk.dtype.itemsize).T
+    return zlib.compress(chunk.tobytes(), level)
+
+
+def _convert(data, dtype):
+    """
+    Convert data with the HDF5 type conversion.
+
+    Unlike numpy, HDF5 saturates values out of range of the new type.
+    """
+    data = np.ascontiguousarray(data)
+    dtype = np.dtype(dtype)
+    if data.dtype == dtype:
+        return data
+    n = len(data)
+    buf = np.empty(n * max(data.dtype.itemsize, dtype.itemsize), np.uint8)
+    buf[:data.nbytes] = data.view(np.uint8)
+    h5py.h5t.convert(h5py.h5t.py_create(data.dtype),
+                     h5py.h5t.py_create(dtype), n, buf)
+    return buf[:n * dtype.itemsize].view(dtype)
+
+
+def _write_chunks(dataset, data, pool):
+    """
+    Compress chunks in parallel and write them with direct chunk writes.
+
+    The resulting file can be read with the standard HDF5 filters.
+    """
+    data = _convert(data, dataset.dtype)
+    level = dataset.compression_opts
+    if level is None:
+        level = 4
+    size = dataset.chunks[0]
+    chunks = []
+    for i in range(0, len(data), size):
+        chunk = data[i:i + size]
+        if len(chunk) < size:
+            # HDF5 stores edge chunks with full size
+            chunk = np.concatenate([chunk, np.zeros(size - len(chunk),
+                                                    dtype=chunk.dtype)])
+        chunks.append(chunk)
+    compressed = pool.map(_compress_chunk, chunks,
+                          [dataset.shuffle] * len(chunks),
+                          [level] * len(chunks))
+    for i, chunk in enumerate(compressed):
+        dataset.id.write_direct_chunk((i * size,), chunk)
+
+
+def _index_regex(index):
+    """Return regex matching names created with index."""
+    regex = []
+    names = set()
+    for literal, field, _, _ in string.Formatter().parse(index):
+        regex.append(re.escape(literal))
+        if field is None:
+            continue
+        if field.isidentifier() and field not in names:
+            names.add(field)
+            regex.append('(?P<%s>.*?)' % field)
+        else:
+            regex.append('.*?')
+    return re.compile(''.join(regex) + '$')
+
+
+def _trc_num(index, path):
+    """Return trace number of path created with index, defaults to 0."""
+    match = _index_regex(index).search(path)
+    try:
+        return int(match.group('trc_num'))
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+
+def _format_index(index, trace, trc_num):
+    duration = trace.stats.endtime - trace.stats.starttime
+    return index.format(trc_num=trc_num, id=trace.id, duration=duration,
+                        **trace.stats)
+
+
+def _header_items(trace, ignore=(), utc2str=True):
+    """Yield headers to write, UTCDateTime objects are converted to str."""
     ignore = tuple(ignore) + _IGNORE
     if '_format' in trace.stats and '_format' in _IGNORE:
         # ignore format specific header by default, e.g. trace.stats.mseed
         ignore = ignore + (trace.stats._format.lower(),)
-    jsondata = {}
     for key, val in trace.stats.items():
         if key not in ignore:
-            if _is_utc(val):
+            if utc2str and _is_utc(val):
                 val = str(val)
-            if isinstance(val, (tuple, list, AttribDict)):
-                jsondata[key] = val
-            else:
-                try:
-                    dataset.attrs[key] = val
-                except (KeyError, TypeError):
-                    jsondata[key] = val
-    if len(jsondata) > 0:
-        dataset.attrs['_json'] = json.dumps(jsondata, cls=_FlexibleEncoder)
+            yield key, val
+
+
+def _packed_path(trace, index, trc_num, dtype):
+    """Return path of the packed dataset for trace."""
+    parent = posixpath.dirname(_format_index(index, trace, trc_num))
+    name = '%s%d_%s' % (_PACKED, len(trace.data), np.dtype(dtype).name)
+    return posixpath.join(parent, name)
+
+
+def _write_packed(traces, group, path, ignore=(), **kwargs):
+    """
+    Append traces of equal length as rows to packed dataset.
+
+    Return rows for the header table.
+    """
+    npts = len(traces[0].data)
+    if path in group:
+        dataset = group[path]
+        headers = group[path + _PACKED_HEADERS]
+    else:
+        dtype = np.dtype(kwargs.pop('dtype', traces[0].data.dtype))
+        kwargs.setdefault(
+            'chunks', (max(1, 2 ** 16 // max(1, npts * dtype.itemsize)),
+                       max(1, npts)))
+        dataset = group.create_dataset(path, (0, npts), dtype=dtype,
+                                       maxshape=(None, npts), **kwargs)
+        headers = group.create_dataset(
+            path + _PACKED_HEADERS, (0,), dtype=_packed_dtype(),
+            maxshape=(None,), chunks=(1024,))
+    n = len(dataset)
+    with _timer('write_data'):
+        dataset.resize(n + len(traces), axis=0)
+        dataset[n:] = data = np.array([tr.data for tr in traces])
+    with _timer('write_attrs'):
+        _append_rows(headers, [
+            _header_row(tr, dataset)[:5] +
+            (json.dumps(dict(_header_items(tr, ignore)),
+                        cls=_FlexibleEncoder),)
+            for tr in traces])
+    if _PROFILES:
+        _count('traces_written', len(traces))
+        _count('bytes_written', data.nbytes)
+    return [_header_row(tr, dataset, n + i) for i, tr in enumerate(traces)]
+
 
+def _sample_window(stats, npts, starttime=None, endtime=None):
+    """Return start and stop sample of the time window in the dataset."""
+    t0 = stats.get('starttime', UTC(0))
+    sr = 1.0 / stats.get('delta', 1.0)
+    i0 = 0
+    i1 = npts
+    # round to the nearest sample like Trace.trim
+    if starttime is not None:
+        i0 = int(np.floor((UTC(starttime) - t0) * sr + 0.5))
+    if endtime is not None:
+        t1 = t0 + (npts - 1) / sr
+        i1 = npts - int(np.floor((t1 - UTC(endtime)) * sr + 0.5))
+    i0 = min(max(i0, 0), npts)
+    i1 = min(max(i1, i0), npts)
+    return i0, i1
 
-def dataset2trace(dataset, headonly=False):
-    """Load trace from dataset."""
-    stats = AttribDict(dataset.attrs)
+
+def _decode_attrs(attrs):
+    """Return stats decoded from the attributes of a dataset."""
+    attrs = dict(attrs)
+    for key in _INTERNAL_ATTRS:
+        attrs.pop(key, None)
+    header = attrs.pop('_header', None)
+    if header is not None:
+        return _decode_compact(header, attrs)
+    stats = AttribDict(attrs)
     for key, val in stats.items():
         # decode bytes to utf-8 string for py3
         if isinstance(val, bytes):
@@ -278,11 +2273,420 @@ def dataset2trace(dataset, headonly=False):
             stats[key] = json.loads(val)
     jsondata = stats.pop('_json', None)
     if jsondata is not None:
-        for k, v in json.loads(jsondata).items():
+        with _timer('json'):
+            jsondata = json.loads(jsondata)
+        for k, v in jsondata.items():
             stats[k] = v
+    return stats
+
+
+def _decode_compact(header, attrs):
+    """Return stats decoded from attributes written by the compact codec."""
+    stats = AttribDict(_compact_fields(header))
+    jsondata = attrs.pop('_json', None)
+    for key, val in attrs.items():
+        if isinstance(val, bytes):
+            val = val.decode('utf-8')
+        stats[key] = val
+    if jsondata is not None:
+        with _timer('json'):
+            jsondata = json.loads(jsondata, object_hook=_json_hook)
+        for k, v in jsondata.items():
+            stats[k] = v
+    return stats
+
+
+def _decode_packed_header(header):
+    """Return stats decoded from a row of the packed header table."""
+    if isinstance(header, bytes):
+        header = header.decode('utf-8')
+    stats = AttribDict()
+    with _timer('json'):
+        header = json.loads(header)
+    for key, val in header.items():
+        stats[key] = UTC(val) if _is_utc(val) else val
+    return stats
+
+
+def dataset2trace(dataset, headonly=False, starttime=None, endtime=None,
+                  pad=False, fill_value=None, row=None, mmap=False,
+                  lazy=False):
+    """
+    Load trace from dataset, optionally only a time window.
+
+    row selects the trace of a dataset written with the packed layout.
+    """
+    dtype = None
+    with _timer('decode'):
+        if row is None:
+            attrs = dict(dataset.attrs)
+            # original data type of data written with compression='auto'
+            dtype = attrs.get('_dtype')
+            stats = _decode_attrs(attrs)
+        else:
+            headers = dataset.file[dataset.name + _PACKED_HEADERS]
+            stats = _decode_packed_header(headers[row]['header'])
+    if _PROFILES:
+        _count('attrs_decoded', len(stats))
+    return _stats2trace(stats, dataset, row=row, headonly=headonly,
+                        starttime=starttime, endtime=endtime, pad=pad,
+                        fill_value=fill_value, mmap=mmap, lazy=lazy,
+                        dtype=dtype)
+
+
+def _packed2traces(dataset, refresh=False, levels=(), **kwargs):
+    """
+    Load all traces from a dataset written with the packed layout.
+
+    Only traces matching levels of the index are loaded, see _walk.
+    """
+    headers = dataset.file[dataset.name + _PACKED_HEADERS]
+    index = dataset.file.attrs.get('index', _INDEX)
+    start = 0
+    while True:
+        if refresh:
+            headers.refresh()
+            dataset.refresh()
+        # rows may be missing in one of the datasets while a writer appends
+        n = min(len(headers), len(dataset))
+        if n <= start:
+            return
+        for row, header in enumerate(headers.fields('header')[start:n],
+                                     start):
+            with _timer('decode'):
+                stats = _decode_packed_header(header)
+            if not _match_packed(levels, index, stats, dataset.shape[-1]):
+                continue
+            if _PROFILES:
+                _count('attrs_decoded', len(stats))
+            yield _stats2trace(stats, dataset, row=row, **kwargs)
+        if not refresh:
+            return
+        # pick up rows appended in the meantime
+        start = n
+
+
+def _memmap(dataset):
+    """
+    Return read-only memory map of dataset.
+
+    Returns None if the dataset is not stored contiguously and unfiltered.
+    """
+    if (dataset.chunks is not None or dataset.size == 0 or
+            dataset.file.driver not in ('sec2', 'stdio')):
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dataset.file.filename, mode='r', dtype=dataset.dtype,
+                     offset=offset, shape=dataset.shape)
+
+
+def _read_data(dataset, row=None, i0=0, i1=None):
+    """Read samples i0:i1 of dataset (and row for the packed layout)."""
+    with _timer('read'):
+        if row is not None:
+            data = dataset[row, i0:i1]
+        elif i0 == 0 and i1 in (None, len(dataset)):
+            data = dataset[...]
+        else:
+            data = dataset[i0:i1]
+    if _PROFILES:
+        _count('bytes_read', data.nbytes)
+    return data
+
+
+class _DataCache(object):
+    """Least recently used cache of trace data with a byte budget."""
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """Return cached data for key, call load on cache miss."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+        data = load()
+        data.flags.writeable = False
+        with self._lock:
+            if key not in self._data:
+                self._data[key] = data
+                self.nbytes += data.nbytes
+            self._evict(keep=1)
+        return data
+
+    def _evict(self, keep=0):
+        while self.nbytes > self.maxbytes and len(self._data) > keep:
+            _, old = self._data.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def resize(self, maxbytes):
+        with self._lock:
+            self.maxbytes = maxbytes
+            self._evict()
+
+    def invalidate(self, fname):
+        """Remove data of file, e.g. before it is opened for writing."""
+        path = os.path.abspath(fname)
+        with self._lock:
+            for key in [key for key in self._data if key[0] == path]:
+                self.nbytes -= self._data.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+
+_CACHE = _DataCache(2 ** 30)
+
+
+def _file_id(fname):
+    """Return identity of file, None if it is not a file on disk."""
+    try:
+        st = os.stat(fname)
+    except (OSError, TypeError, ValueError):
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class _FileCache(object):
+    """
+    Least recently used cache of files opened for reading.
+
+    Files are invalidated when their modification time changes.
+    Files in use are not closed before they are released.
+    """
+
+    def __init__(self, maxopen=0):
+        self.maxopen = maxopen
+        self._files = OrderedDict()  # path -> entry
+        self._entries = {}  # id of file -> entry
+        self._lock = threading.Lock()
+
+    def acquire(self, fname):
+        """Return opened file, it has to be released after use."""
+        path = os.path.abspath(fname)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None and entry['mtime'] != mtime:
+                self._remove(path)
+                entry = None
+            if entry is not None:
+                self._files.move_to_end(path)
+                entry['users'] += 1
+                if _PROFILES:
+                    _count('file_cache_hits')
+                return entry['file']
+        with _timer('open'):
+            f = h5py.File(path, 'r')
+        if _PROFILES:
+            _count('files_opened')
+        entry = {'file': f, 'mtime': mtime, 'users': 1, 'stale': False}
+        with self._lock:
+            self._entries[id(f)] = entry
+            if path in self._files:
+                # opened concurrently by another thread
+                entry['stale'] = True
+            else:
+                self._files[path] = entry
+                self._evict()
+        return f
+
+    def release(self, f):
+        with self._lock:
+            entry = self._entries[id(f)]
+            entry['users'] -= 1
+            if entry['stale'] and entry['users'] == 0:
+                self._close(entry)
+            self._evict()
+
+    def evict(self, fname):
+        """Close file, e.g. before it is opened for writing."""
+        if not isinstance(fname, (str, os.PathLike)):
+            return
+        path = os.path.abspath(fname)
+        with self._lock:
+            if path in self._files:
+                self._remove(path)
+
+    def _remove(self, path):
+        entry = self._files.pop(path)
+        entry['stale'] = True
+        if entry['users'] == 0:
+            self._close(entry)
+
+    def _close(self, entry):
+        del self._entries[id(entry['file'])]
+        entry['file'].close()
+
+    def _evict(self):
+        unused = [path for path, entry in self._files.items()
+                  if entry['users'] == 0]
+        for path in unused[:max(len(self._files) - self.maxopen, 0)]:
+            self._remove(path)
+
+    def resize(self, maxopen):
+        with self._lock:
+            self.maxopen = maxopen
+            self._evict()
+
+
+_FILES = _FileCache()
+
+
+def _evict(fname):
+    """Close cached file and drop its cached data before writing to it."""
+    if isinstance(fname, (str, os.PathLike)):
+        _FILES.evict(fname)
+        _CACHE.invalidate(fname)
+
+
+@contextmanager
+def _open(fname, mode='r', **kwargs):
+    """Open file, files opened for reading are taken from the cache."""
+    if (mode == 'r' and not kwargs and _FILES.maxopen > 0 and
+            isinstance(fname, (str, os.PathLike))):
+        f = _FILES.acquire(fname)
+        try:
+            yield f
+        finally:
+            _FILES.release(f)
+        return
+    if mode != 'r':
+        _evict(fname)
+    with _timer('open'):
+        f = h5py.File(fname, mode, **kwargs)
+    if _PROFILES:
+        _count('files_opened')
+    with f:
+        yield f
+
+
+def set_file_cache(maxopen=0):
+    """
+    Keep files opened for reading in a cache for later calls.
+
+    Repeated reads of the same files, e.g. many small selections with
+    readonly, skip opening the file. Files are closed when more than
+    maxopen files are cached (least recently used first), they are reopened
+    if their modification time changed. Files are closed before obspyh5
+    opens them for writing. Files opened in other modes or in SWMR mode are
+    not cached.
+
+    :param maxopen: maximal number of cached open files,
+        0 disables the cache (default)
+    """
+    _FILES.resize(maxopen)
+
+
+class _DataLoader(object):
+    """Load data of a lazy trace through the cache."""
+
+    def __init__(self, fname, path, row=None, i0=0, i1=None, dtype=None,
+                 cache=None, check=True):
+        # the identity of the file invalidates data of rewritten files,
+        # it is not checked for files appended to in SWMR mode
+        fileid = _file_id(fname) if check else None
+        self.key = (os.path.abspath(fname), fileid, path, row, i0, i1,
+                    dtype)
+        self.cache = cache
+
+    def load(self):
+        cache = _CACHE if self.cache is None else self.cache
+        return cache.get(self.key, self._load)
+
+    def _load(self):
+        fname, fileid, path, row, i0, i1, dtype = self.key
+        if fileid is not None and _file_id(fname) != fileid:
+            msg = ("File '%s' was changed after reading the lazy trace, "
+                   'read the file again.') % fname
+            raise OSError(msg)
+        with _open(fname) as f:
+            data = _read_data(f[path], row=row, i0=i0, i1=i1)
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        # the cache is not pickled, the global cache is used instead
+        return {'key': self.key, 'cache': None}
+
+
+class _LazyTrace(Trace):
+    """Trace loading its data from the HDF5 file on first access."""
+
+    @property
+    def data(self):
+        loader = self.__dict__.get('_loader')
+        if loader is None:
+            return self.__dict__['_data']
+        return loader.load()
+
+    @data.setter
+    def data(self, value):
+        self.__dict__['_loader'] = None
+        self.__dict__['_data'] = value
+
+
+def set_cache_size(maxbytes=2 ** 30):
+    """
+    Set size of the cache holding data of lazily loaded traces.
+
+    Least recently used data is evicted from the cache when its size exceeds
+    maxbytes, it will be reloaded from the file on the next access.
+
+    :param maxbytes: size of cache in bytes, defaults to 1 GiB
+    """
+    _CACHE.resize(maxbytes)
+
+
+def _stats2trace(stats, dataset, row=None, headonly=False, starttime=None,
+                 endtime=None, pad=False, fill_value=None, mmap=False,
+                 lazy=False, dtype=None):
+    """
+    Create trace from decoded stats and (a window of) the dataset.
+
+    Data is converted to dtype if given.
+    """
+    npts = dataset.shape[-1]
+    window = starttime is not None or endtime is not None
+    i0, i1 = 0, npts
+    if window:
+        if 'starttime' in stats:
+            stats['starttime'] = UTC(stats['starttime'])
+        i0, i1 = _sample_window(stats, npts, starttime, endtime)
+        if i0 > 0:
+            stats['starttime'] += i0 * stats.get('delta', 1.0)
+    data = _memmap(dataset) if mmap and row is None and not headonly else None
     if headonly:
-        stats['npts'] = len(dataset)
+        stats['npts'] = i1 - i0
         trace = Trace(header=stats)
+    elif lazy and data is None:
+        stats['npts'] = i1 - i0
+        trace = _LazyTrace(header=stats)
+        trace._loader = _DataLoader(dataset.file.filename, dataset.name,
+                                    row=row, i0=i0, i1=i1, dtype=dtype,
+                                    check=not dataset.file.swmr_mode)
     else:
-        trace = Trace(data=dataset[...], header=stats)
+        if data is not None:
+            data = data[i0:i1]
+        else:
+            data = _read_data(dataset, row=row, i0=i0, i1=i1)
+        if dtype is not None:
+            data = data.astype(dtype)
+        trace = Trace(data=data, header=stats)
+        if pad:
+            trace.trim(starttime, endtime, pad=True, fill_value=fill_value)
+    if _PROFILES:
+        _count('traces_read')
     return trace
@@ -1,16 +1,28 @@
 # Copyright 2013-2016 Tom Eulenfeld, MIT license
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
 import unittest
 import warnings
 
 import h5py
 import numpy as np
-from obspy import read
+from obspy import read, Stream
 from obspy.core import UTCDateTime as UTC
 from obspy.core.util import NamedTemporaryFile
-from obspyh5 import readh5, writeh5, trace2group, iterh5, set_index
+from obspyh5 import (readh5, writeh5, trace2group, iterh5, set_index,
+                     read_headers, H5Writer, readh5_many, iterh5_many,
+                     aiterh5, Profile, consolidate, read_array,
+                     update_headers, set_file_cache, ParallelH5Writer,
+                     repack)
 import obspyh5
 
 
+def _submit(writer, stream):
+    writer.write(stream)
+
+
 class HDF5TestCase(unittest.TestCase):
 
     def setUp(self):
@@ -171,6 +183,752 @@ class HDF5TestCase(unittest.TestCase):
             stream2[0].stats.header = -42
             self.assertEqual(len(stream2[0]), 0)
 
+    def test_header_table(self):
+        stream = self.stream.copy()
+        stream2 = stream.copy()
+        for tr in stream2:
+            tr.stats.starttime += 3600
+        stream3 = stream + stream2
+        t1 = stream2[0].stats.starttime
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            stream3.write(fname, 'H5')
+            with h5py.File(fname, 'r') as f:
+                self.assertEqual(len(f[obspyh5._HEADER_TABLE]), 6)
+            st1 = readh5(fname, starttime=t1 - 10)
+            st2 = readh5(fname, endtime=t1 - 10, seed_id='BW.RJOB..EH[ZN]')
+            st3 = readh5(fname, starttime=t1, seed_id='*E', headonly=True)
+            # same results without header table
+            with h5py.File(fname, 'a') as f:
+                del f[obspyh5._HEADER_TABLE]
+            st4 = readh5(fname, starttime=t1 - 10)
+        self.assertEqual(st1, stream2)
+        self.assertEqual(st2, stream[:2])
+        self.assertEqual(len(st3), 1)
+        self.assertEqual(st3[0].stats, stream2[2].stats)
+        self.assertEqual(st4, stream2)
+
+    def test_time_window(self):
+        stream = self.stream
+        t1 = stream[0].stats.starttime + 2.013
+        t2 = t1 + 5
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(stream, fname, chunks=(100,))
+            stream2 = readh5(fname, starttime=t1, endtime=t2)
+            stream3 = readh5(fname, starttime=t1, endtime=t2, headonly=True)
+            stream4 = readh5(fname, starttime=t1 - 100, endtime=t2, pad=True,
+                             fill_value=0)
+        stream5 = stream.copy().trim(t1, t2)
+        stream6 = stream.copy().trim(t1 - 100, t2, pad=True, fill_value=0)
+        nproc = len(stream[0].stats.processing)
+        for tr in stream5 + stream6 + stream4:
+            tr.stats.processing = tr.stats.processing[:nproc]
+        self.assertEqual(stream2, stream5)
+        self.assertEqual(stream4, stream6)
+        for tr2, tr3 in zip(stream2, stream3):
+            self.assertEqual(tr2.stats, tr3.stats)
+
+    def test_packed_layout(self):
+        stream = self.stream.copy()
+        stream2 = stream.copy()
+        for tr in stream2:
+            tr.stats.starttime += 3600
+        stream3 = stream + stream2
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(stream3[:4], fname, layout='packed')
+            writeh5(stream3[4:5], fname, mode='a', layout='packed')
+            writeh5(stream3[5:], fname, mode='a')
+            with h5py.File(fname, 'r') as f:
+                # one packed dataset and its header table + one dataset
+                self.assertEqual(len(f['waveforms']), 3)
+            stream4 = readh5(fname)
+            stream5 = readh5(fname, starttime=stream2[0].stats.starttime,
+                             seed_id='*Z')
+            stream6 = readh5(fname, headonly=True)
+            with h5py.File(fname, 'a') as f:
+                del f[obspyh5._HEADER_TABLE]
+            stream7 = readh5(fname, starttime=stream2[0].stats.starttime)
+        self.assertEqual(stream4, stream3)
+        self.assertEqual(stream5, stream2[:1])
+        self.assertEqual([tr.stats for tr in stream6.sort()],
+                         [tr.stats for tr in stream3.sort()])
+        self.assertEqual(stream7, stream2)
+        with self.assertRaises(ValueError):
+            writeh5(stream, fname, layout='bla')
+
+    def test_read_headers(self):
+        stream = self.stream
+        fields = ['id', 'starttime', 'endtime', 'sampling_rate', 'npts',
+                  'onset', 'header', 'stack']
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(stream, fname)
+            h1 = read_headers(fname)
+            h2 = read_headers(fname, fields=fields)
+            h3 = read_headers(fname, fields=['id'], seed_id='*N')
+            writeh5(stream, fname, layout='packed')
+            h4 = read_headers(fname, fields=fields)
+            with h5py.File(fname, 'a') as f:
+                del f[obspyh5._HEADER_TABLE]
+            h5 = read_headers(fname)
+        for h in (h1, h2, h4, h5):
+            self.assertEqual(list(h['id']), [tr.id for tr in stream])
+            self.assertEqual(list(h['npts']), [tr.stats.npts for tr in stream])
+            self.assertEqual(list(h['sampling_rate']),
+                             [tr.stats.sampling_rate for tr in stream])
+            for field in ('starttime', 'endtime'):
+                self.assertEqual(
+                    [UTC(str(t)) for t in h[field]],
+                    [tr.stats[field] for tr in stream])
+        for h in (h2, h4):
+            self.assertEqual(UTC(str(h['onset'][0])), stream[0].stats.onset)
+            self.assertTrue(np.isnat(h['onset'][1]))
+            self.assertEqual(h['header'][0], 42)
+            self.assertEqual(h['stack'][0], stream[0].stats.stack)
+        self.assertEqual(list(h3['id']), [stream[1].id])
+
+    def test_mmap(self):
+        stream = self.stream
+        t1 = stream[0].stats.starttime + 5
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(stream[:2], fname)
+            writeh5(stream[2:], fname, mode='a', compression='gzip')
+            stream2 = readh5(fname, mmap=True)
+            stream3 = readh5(fname, mmap=True, starttime=t1)
+            self.assertIsInstance(stream2[0].data, np.memmap)
+            self.assertNotIsInstance(stream2[2].data, np.memmap)
+            self.assertIsInstance(stream3[0].data, np.memmap)
+            with self.assertRaises(ValueError):
+                stream2[0].data[0] = 0
+            self.assertEqual(stream2, stream)
+            self.assertEqual(stream3[0].stats.starttime, t1)
+            del stream2, stream3
+
+    def test_lazy(self):
+        stream = self.stream
+        t1 = stream[0].stats.starttime + 5
+        nbytes = stream[0].data.nbytes
+        try:
+            obspyh5.set_cache_size(2 * nbytes)
+            with NamedTemporaryFile(suffix='.h5') as ft:
+                fname = ft.name
+                writeh5(stream, fname)
+                stream2 = readh5(fname, lazy=True)
+                stream3 = readh5(fname, lazy=True, starttime=t1)
+                self.assertEqual(obspyh5._CACHE.nbytes, 0)
+                self.assertEqual([len(tr) for tr in stream2],
+                                 [len(tr) for tr in stream])
+                self.assertEqual(stream2, stream)
+                self.assertEqual(obspyh5._CACHE.nbytes, 2 * nbytes)
+                self.assertEqual(stream3[0].stats.starttime, t1)
+                np.testing.assert_array_equal(
+                    stream3[0].data, stream[0].slice(t1).data)
+                # new data is kept in memory
+                stream2.differentiate()
+                # cached data of rewritten files is not used
+                stream4 = stream.copy()
+                for tr in stream4:
+                    tr.data = tr.data[::-1].copy()
+                stream5 = readh5(fname, lazy=True)
+                writeh5(stream4, fname)
+                self.assertEqual(readh5(fname, lazy=True), stream4)
+                with self.assertRaises(OSError):
+                    stream5[0].data
+                with self.assertRaises(ValueError):
+                    readh5(fname, lazy=True, starttime=t1, pad=True)
+            self.assertEqual(stream2, stream.copy().differentiate())
+        finally:
+            obspyh5.set_cache_size()
+            obspyh5._CACHE.clear()
+
+    def test_writer(self):
+        stream = self.stream
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            with H5Writer(fname, mode='w', flush_every=2) as writer:
+                writer.write(stream[0])
+                self.assertEqual(writer.file.attrs['offset_trc_num'], 0)
+                writer.write(stream[1:])
+                self.assertEqual(writer.file.attrs['offset_trc_num'], 3)
+                writer.write(stream)
+            with H5Writer(fname, layout='packed') as writer:
+                writer.write(stream)
+                writer.flush()
+                writer.write(stream)
+            stream2 = readh5(fname)
+            headers = read_headers(fname, fields=['path', 'row'])
+        self.assertEqual(stream2, stream * 4)
+        self.assertEqual(len(headers), 12)
+        self.assertEqual(list(headers['row'][6:]), [0, 1, 2, 3, 4, 5])
+
+    def test_swmr(self):
+        stream = self.stream
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            with H5Writer(fname, mode='w', layout='packed',
+                          swmr=True) as writer:
+                writer.write(stream)
+                writer.flush()
+                self.assertTrue(writer.file.swmr_mode)
+                traces = iterh5(fname, swmr=True)
+                tr = next(traces)
+                # traces appended while reading are picked up
+                writer.write(stream)
+                writer.flush()
+                stream2 = readh5(fname, swmr=True, seed_id='*Z')
+                traces = [tr] + list(traces)
+        self.assertEqual(len(traces), 6)
+        self.assertEqual(traces, (stream * 2).traces)
+        self.assertEqual(stream2, stream[:1] * 2)
+
+    def test_read_many(self):
+        stream = self.stream
+        with NamedTemporaryFile(suffix='.h5') as ft1, \
+                NamedTemporaryFile(suffix='.h5') as ft2:
+            fnames = [ft1.name, ft2.name, ft1.name]
+            writeh5(stream[:1], ft1.name)
+            writeh5(stream[1:], ft2.name)
+            stream2 = readh5_many(fnames, workers=2)
+            traces = list(iterh5_many(fnames, workers=2, ordered=False,
+                                      headonly=True))
+        self.assertEqual(stream2.traces, (stream + stream[:1]).traces)
+        self.assertEqual(sorted(tr.id for tr in traces),
+                         sorted(tr.id for tr in stream + stream[:1]))
+        self.assertEqual(len(traces[0].data), 0)
+
+    def test_aiter(self):
+        stream = self.stream
+
+        async def read(fname, n=None, **kwargs):
+            traces = []
+            async for tr in aiterh5(fname, prefetch=1, **kwargs):
+                traces.append(tr)
+                if len(traces) == n:
+                    break
+            return traces
+
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(stream, fname)
+            traces = asyncio.run(read(fname))
+            traces2 = asyncio.run(read(fname, n=1, headonly=True))
+            with self.assertRaises(KeyError):
+                asyncio.run(read(fname, group='bla'))
+        self.assertEqual(traces, stream.traces)
+        self.assertEqual(len(traces2), 1)
+        self.assertEqual(traces2[0].stats, stream[0].stats)
+
+    def test_compression_workers(self):
+        stream = self.stream.copy()
+        stream.append(stream[0].copy())
+        stream[-1].data = np.arange(1000, dtype='int16')
+
+        def storage_sizes(fname):
+            with h5py.File(fname, 'r') as f:
+                return [f['waveforms'][name].id.get_storage_size()
+                        for name in f['waveforms']]
+
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            for kw in ({'compression': 'gzip', 'chunks': (128,)},
+                       {'compression': 9, 'shuffle': True}):
+                writeh5(stream, fname, **kw)
+                sizes = storage_sizes(fname)
+                writeh5(stream, fname, compression_workers=2, **kw)
+                # HDF5 filters produce the same compressed chunks
+                self.assertEqual(storage_sizes(fname), sizes)
+                stream2 = readh5(fname)
+                self.assertEqual(stream2, stream)
+            # values out of range are saturated like by HDF5
+            stream3 = stream[:1].copy()
+            stream3[0].data = np.array([40000., -40000., 1.6, 2.5])
+            kw = {'compression': 'gzip', 'dtype': 'int16'}
+            writeh5(stream3, fname, **kw)
+            data = readh5(fname)[0].data
+            writeh5(stream3, fname, compression_workers=2, **kw)
+            data2 = readh5(fname)[0].data
+            np.testing.assert_array_equal(data, [32767, -32768, 1, 2])
+            np.testing.assert_array_equal(data2, data)
+
+    def test_continuous(self):
+        tr = self.stream[0]
+        t0 = tr.stats.starttime
+        pieces = [tr.slice(t0 + t, t0 + t + 5 - tr.stats.delta)
+                  for t in (0, 5, 10, 20)]
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(pieces[:2], fname, continuous=True)
+            writeh5(pieces[2:], fname, mode='a', continuous=True)
+            with h5py.File(fname, 'r') as f:
+                names = sorted(f['waveforms'])
+            stream2 = readh5(fname)
+            stream3 = readh5(fname, starttime=t0 + 18)
+            headers = read_headers(fname)
+            # other headers than starttime start a new segment
+            pieces[1].stats.calib = 2.0
+            writeh5(pieces[:2], fname, continuous=True)
+            stream4 = readh5(fname)
+        self.assertEqual(len(names), 2)
+        self.assertEqual([tr4.stats.calib for tr4 in stream4], [1.0, 2.0])
+        self.assertEqual(stream4[1].stats.starttime, t0 + 5)
+        self.assertTrue(names[0].endswith('_15.0s'))
+        self.assertEqual(len(stream2), 2)
+        for tr2, t1, t2 in zip(stream2, (0, 20), (15, 25)):
+            tr3 = tr.slice(t0 + t1, t0 + t2 - tr.stats.delta)
+            self.assertEqual(tr2.stats.starttime, tr3.stats.starttime)
+            np.testing.assert_array_equal(tr2.data, tr3.data)
+        self.assertEqual(len(stream3), 1)
+        self.assertEqual(list(headers['npts']),
+                         [tr2.stats.npts for tr2 in stream2])
+        self.assertEqual(UTC(str(headers['endtime'][0])),
+                         stream2[0].stats.endtime)
+
+    def test_readonly_patterns(self):
+        stream = self.stream.copy()
+        stream2 = stream.copy()
+        for tr in stream2:
+            tr.stats.station = 'RJOC'
+            tr.stats.channel = tr.stats.channel.replace('E', 'B', 1)
+        stream3 = stream + stream2
+        set_index('nested')
+        try:
+            with NamedTemporaryFile(suffix='.h5') as ft:
+                fname = ft.name
+                writeh5(stream3, fname)
+                st1 = readh5(fname, readonly={'channel': 'BH?'})
+                st2 = readh5(fname, readonly={'station': 'RJ*',
+                                              'channel': ['EHZ', 'BHN']})
+                st3 = readh5(fname, readonly={'network': 'BW',
+                                              'station': re.compile('.*C'),
+                                              'channel': '[!B]H?'})
+                st4 = readh5(fname, readonly={'channel': '*Z'},
+                             starttime=stream[0].stats.starttime)
+                st5 = readh5(fname, readonly={'network': 'BW',
+                                              'station': 'RJOB',
+                                              'location': '',
+                                              'channel': 'EHN'})
+        finally:
+            set_index()
+        self.assertEqual(st1, stream2)
+        self.assertEqual(st2, Stream([stream[0], stream2[1]]))
+        self.assertEqual(len(st3), 0)
+        self.assertEqual(st4, Stream([stream[0], stream2[0]]))
+        self.assertEqual(st5, stream[1:2])
+        # traces of packed datasets are matched one by one
+        for index in ('standard', 'flat'):
+            set_index(index)
+            try:
+                with NamedTemporaryFile(suffix='.h5') as ft:
+                    fname = ft.name
+                    writeh5(stream3, fname, layout='packed')
+                    readonly = {'id': 'BW.RJOC..BH[NZ]'}
+                    st6 = readh5(fname, readonly=readonly)
+                    st7 = readh5(fname, readonly=readonly, seed_id='*')
+                    data, headers = read_array(fname, readonly=readonly)
+                    with h5py.File(fname, 'a') as f:
+                        del f[obspyh5._HEADER_TABLE]
+                    st8 = readh5(fname, readonly=readonly, seed_id='*')
+            finally:
+                set_index()
+            for st in (st6, st7, st8):
+                self.assertEqual(st, stream2[:2])
+            self.assertEqual(data.shape, (2, len(stream2[0])))
+            self.assertEqual(list(headers['id']),
+                             [tr.id for tr in stream2[:2]])
+
+    def test_compact_header_codec(self):
+        stream = self.stream.copy().sort()
+        stream[0].stats.stack = {'group': 'all', 'time': UTC(2010, 1, 1)}
+        stream[0].stats.weights = np.arange(3.)
+        stream[0].stats.count = np.int64(3)
+        stream[1].stats.calib = 0.5
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(stream, fname, header_codec='compact')
+            with h5py.File(fname, 'r') as f:
+                attrs = f[f[obspyh5._HEADER_TABLE][0]['path']].attrs
+                self.assertIn('_header', attrs)
+                self.assertNotIn('network', attrs)
+            stream2 = readh5(fname).sort()
+            headers = read_headers(fname, fields=('id', 'starttime', 'calib',
+                                                  'onset', 'count'))
+            # same results without header table
+            with h5py.File(fname, 'a') as f:
+                del f[obspyh5._HEADER_TABLE]
+            stream3 = readh5(fname).sort()
+        weights = stream[0].stats.pop('weights')
+        for st in (stream2, stream3):
+            np.testing.assert_array_equal(st[0].stats.pop('weights'), weights)
+        self.assertEqual(stream, stream2)
+        self.assertEqual(stream, stream3)
+        self.assertIsInstance(stream2[0].stats.stack.time, UTC)
+        self.assertEqual(headers['starttime'][0],
+                         np.datetime64(stream[0].stats.starttime.ns, 'ns'))
+        self.assertEqual(sorted(headers['calib']), [0.5, 1.0, 1.0])
+        onset = np.datetime64(self.stream[0].stats.onset.ns, 'ns')
+        self.assertEqual(np.sum(headers['onset'] == onset), 1)
+        with self.assertRaises(ValueError):
+            writeh5(stream, 'test', header_codec='json')
+        # ignored common headers are not stored with both codecs
+        streams = []
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            for header_codec in obspyh5._HEADER_CODECS:
+                writeh5(self.stream, fname, header_codec=header_codec,
+                        ignore=('calib', 'channel'))
+                streams.append(readh5(fname).sort())
+        self.assertEqual(streams[0], streams[1])
+        self.assertEqual([tr.stats.calib for tr in streams[1]], [1.0] * 3)
+        self.assertEqual([tr.stats.channel for tr in streams[1]], [''] * 3)
+
+    def test_profile(self):
+        stream = self.stream
+        nbytes = sum(tr.data.nbytes for tr in stream)
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            with Profile() as prof:
+                writeh5(stream, fname)
+            with Profile() as prof2:
+                readh5(fname)
+                readh5(fname, starttime=stream[0].stats.starttime)
+            readh5(fname)
+        counters = prof.as_dict()['counters']
+        self.assertEqual(counters['traces_written'], 3)
+        self.assertEqual(counters['bytes_written'], nbytes)
+        self.assertGreater(counters['attrs_written'], 3)
+        result = prof2.as_dict()
+        counters = result['counters']
+        self.assertEqual(counters['files_opened'], 2)
+        self.assertEqual(counters['datasets_visited'], 6)
+        self.assertEqual(counters['traces_read'], 6)
+        self.assertEqual(counters['bytes_read'], 2 * nbytes)
+        self.assertGreater(counters['attrs_decoded'], 6)
+        self.assertEqual(set(result['timings']),
+                         {'open', 'traverse', 'decode', 'json', 'read'})
+        self.assertEqual(obspyh5._PROFILES, [])
+
+    def test_consolidate(self):
+        stream = self.stream.copy()
+        stream2 = stream.copy()
+        stream3 = stream.copy()
+        for tr in stream2:
+            tr.stats.starttime += 3600
+        for tr in stream3:
+            tr.stats.starttime += 7200
+            tr.stats.station = 'RJOC'
+        with NamedTemporaryFile(suffix='.h5') as ft1, \
+                NamedTemporaryFile(suffix='.h5') as ft2, \
+                NamedTemporaryFile(suffix='.h5') as ft3, \
+                NamedTemporaryFile(suffix='.h5') as ftm:
+            fnames = [ft1.name, ft2.name, ft3.name]
+            master = ftm.name
+            writeh5(stream, fnames[0])
+            writeh5(stream2, fnames[1], header_codec='compact')
+            writeh5(stream3, fnames[2], layout='packed')
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                stream3.write(fnames[2], 'H5', mode='a', layout='packed')
+            # create empty master file
+            writeh5(Stream(), master)
+            self.assertEqual(consolidate(fnames[:2], master), fnames[:2])
+            st1 = readh5(master)
+            self.assertEqual(consolidate(fnames, master), fnames[2:])
+            self.assertEqual(consolidate(fnames, master), [])
+            st2 = readh5(master)
+            st3 = readh5(master, seed_id='*.RJOB.*',
+                         starttime=stream2[0].stats.starttime)
+            st4 = readh5(master, seed_id='*.RJOC.*')
+            headers = read_headers(master, fields=('id', 'path'))
+            with h5py.File(master, 'r') as f:
+                self.assertTrue(all(f[p].is_virtual for p in headers['path']))
+        self.assertEqual(st1.sort(), (stream + stream2).sort())
+        self.assertEqual(st2.sort(),
+                         (stream + stream2 + stream3 + stream3).sort())
+        self.assertEqual(st3.sort(), stream2.sort())
+        self.assertEqual(st4.sort(), (stream3 + stream3).sort())
+        self.assertEqual(len(headers), 12)
+
+    def test_read_array(self):
+        stream = self.stream
+        t1 = stream[0].stats.starttime + 2.013
+        t2 = t1 + 10
+        for layout in ('dataset', 'packed'):
+            with NamedTemporaryFile(suffix='.h5') as ft:
+                fname = ft.name
+                writeh5(stream, fname, layout=layout)
+                data, headers = read_array(fname)
+                data2, headers2 = read_array(
+                    fname, starttime=t1, endtime=t2, dtype='float32',
+                    fields=('id', 'starttime', 'endtime', 'npts', 'calib'))
+                st2 = readh5(fname, starttime=t1, endtime=t2)
+                data3, _ = read_array(fname, seed_id='*Z')
+                with self.assertRaises(ValueError):
+                    stream2 = stream.copy()
+                    stream2[0].data = stream2[0].data[:100]
+                    writeh5(stream2, fname)
+                    read_array(fname)
+            ids = [tr.id for tr in stream]
+            order = [ids.index(id_) for id_ in headers['id']]
+            np.testing.assert_array_equal(
+                data, np.vstack([stream[i].data for i in order]))
+            self.assertEqual(list(headers['npts']), [1500] * 3)
+            self.assertEqual(data2.dtype, np.float32)
+            st2 = st2.select(id=headers2['id'][0])
+            np.testing.assert_array_equal(data2[0],
+                                          st2[0].data.astype('float32'))
+            self.assertEqual(headers2['npts'][0], st2[0].stats.npts)
+            self.assertEqual(headers2['starttime'][0],
+                             np.datetime64(st2[0].stats.starttime.ns, 'ns'))
+            self.assertEqual(headers2['endtime'][0],
+                             np.datetime64(st2[0].stats.endtime.ns, 'ns'))
+            self.assertEqual(list(headers2['calib']), [1.0] * 3)
+            np.testing.assert_array_equal(data3[0],
+                                          stream.select(id='*Z')[0].data)
+
+    def test_update_headers(self):
+        stream = self.stream.copy()
+        pick = UTC('2009-08-24T00:20:10')
+        for header_codec in ('attrs', 'compact'):
+            with NamedTemporaryFile(suffix='.h5') as ft:
+                fname = ft.name
+                writeh5(stream, fname, header_codec=header_codec)
+                with h5py.File(fname, 'r') as f:
+                    offsets = sorted(f[path].id.get_offset() for path in
+                                     f[obspyh5._HEADER_TABLE]['path'])
+                n = update_headers(fname, {'seed_id': '*Z'},
+                                   {'station': 'NEW', 'pick': pick})
+                n2 = update_headers(
+                    fname, None, lambda stats: {'calib': 2 * stats.calib})
+                st1 = readh5(fname).sort()
+                st2 = readh5(fname, seed_id='*.NEW.*')
+                with h5py.File(fname, 'r') as f:
+                    paths = f[obspyh5._HEADER_TABLE]['path'].astype(str)
+                    offsets2 = sorted(f[path].id.get_offset()
+                                      for path in paths)
+            self.assertEqual((n, n2), (1, 3))
+            self.assertEqual(offsets, offsets2)
+            self.assertEqual(sum('NEW' in path for path in paths), 1)
+            self.assertEqual(len(st2), 1)
+            self.assertEqual(st2[0].stats.pick, pick)
+            expected = stream.copy()
+            expected[0].stats.station = 'NEW'
+            expected[0].stats.pick = pick
+            for tr in expected:
+                tr.stats.calib = 2.
+            self.assertEqual(st1, expected.sort())
+        # packed layout
+        set_index('nested')
+        try:
+            with NamedTemporaryFile(suffix='.h5') as ft:
+                fname = ft.name
+                writeh5(stream, fname, layout='packed')
+                update_headers(fname, {'seed_id': '*Z'}, {'pick': pick})
+                st3 = readh5(fname, seed_id='*Z')
+                with self.assertRaises(ValueError):
+                    update_headers(fname, None, lambda stats: {
+                        'calib': 3.0, 'station': 'NEW' if
+                        stats.channel == 'EHZ' else stats.station})
+                st4 = readh5(fname)
+        finally:
+            set_index()
+        self.assertEqual(st3[0].stats.pick, pick)
+        self.assertEqual(st3[0].data.tolist(), stream[0].data.tolist())
+        # no trace is updated
+        self.assertEqual([tr.stats.calib for tr in st4], [1.0] * 3)
+
+    def test_file_cache(self):
+        stream = self.stream
+        set_file_cache(2)
+        try:
+            with NamedTemporaryFile(suffix='.h5') as ft:
+                fname = ft.name
+                writeh5(stream, fname)
+                with Profile() as prof:
+                    self.assertTrue(obspyh5.is_obspyh5(fname))
+                    st1 = readh5(fname)
+                    st2 = readh5(fname, seed_id='*Z')
+                    # writing closes the cached file
+                    writeh5(stream[:1], fname, mode='a')
+                    st3 = readh5(fname)
+                    # changed modification time invalidates cached file
+                    mtime = os.stat(fname).st_mtime_ns
+                    os.utime(fname, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+                    st4 = readh5(fname, headonly=True)
+                self.assertEqual(len(obspyh5._FILES._files), 1)
+        finally:
+            set_file_cache()
+        self.assertEqual(len(obspyh5._FILES._files), 0)
+        counters = prof.as_dict()['counters']
+        self.assertEqual(counters['files_opened'], 4)
+        self.assertEqual(counters['file_cache_hits'], 2)
+        self.assertEqual(st1, stream)
+        self.assertEqual(st2, stream[:1])
+        self.assertEqual(len(st3), 4)
+        self.assertEqual(len(st4), 4)
+
+    def test_parallel_writer(self):
+        streams = []
+        for i in range(4):
+            stream = self.stream.copy()
+            for tr in stream:
+                tr.stats.starttime += 3600 * i
+            streams.append(stream)
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            # small data in the queue, large data in shared memory
+            with ParallelH5Writer(fname, maxsize=2, shm_threshold=5000,
+                                  mode='w', flush_every=5) as writer:
+                stream = streams[0].copy()
+                stream[0].data = stream[0].data[:100]
+                writer.write(stream)
+                with ProcessPoolExecutor(2) as pool:
+                    list(pool.map(_submit, [writer] * 3, streams[1:]))
+            stream2 = readh5(fname).sort()
+            headers = read_headers(fname, fields=('path',))
+            with h5py.File(fname, 'r') as f:
+                trc_num = f.attrs['offset_trc_num']
+        expected = stream
+        for st in streams[1:]:
+            expected += st
+        self.assertEqual(stream2, expected.sort())
+        self.assertEqual(trc_num, 12)
+        self.assertEqual(len(set(headers['path'])), 12)
+        with self.assertRaises(RuntimeError):
+            with ParallelH5Writer(fname, mode='w', layout='wrong'):
+                pass
+
+    def test_override_if_changed(self):
+        stream = self.stream.copy()
+        stream[0].stats.count = np.int64(3)
+        set_index('flat')
+        try:
+            with NamedTemporaryFile(suffix='.h5') as ft:
+                fname = ft.name
+                writeh5(stream, fname, override='if-changed')
+                with h5py.File(fname, 'r') as f:
+                    paths = sorted(f[obspyh5._HEADER_TABLE]['path'])
+                    offsets = [f[p].id.get_offset() for p in paths]
+                with warnings.catch_warnings():
+                    warnings.simplefilter('error')
+                    writeh5(stream, fname, mode='a', override='if-changed')
+                with h5py.File(fname, 'r') as f:
+                    offsets2 = [f[p].id.get_offset() for p in paths]
+                    nrows = len(f[obspyh5._HEADER_TABLE])
+                stream2 = stream.copy()
+                stream2[1].data[0] += 1
+                stream2[2].stats.calib = 2.
+                for _ in range(3):
+                    writeh5(stream2, fname, mode='a', override='if-changed')
+                    writeh5(stream, fname, mode='a', override='if-changed')
+                with h5py.File(fname, 'r') as f:
+                    offsets3 = [f[p].id.get_offset() for p in paths]
+                    nrows2 = len(f[obspyh5._HEADER_TABLE])
+                st1 = readh5(fname)
+                size = os.path.getsize(fname)
+                repack(fname)
+                size2 = os.path.getsize(fname)
+                st2 = readh5(fname)
+        finally:
+            set_index()
+        self.assertEqual(offsets, offsets2)
+        self.assertEqual(nrows, 3)
+        self.assertEqual(offsets[0], offsets3[0])
+        self.assertEqual(nrows2, 3 + 6 * 2)
+        self.assertNotIn('_hash', st1[0].stats)
+        self.assertEqual(st1, stream)
+        self.assertEqual(st2, stream)
+        self.assertLess(size2, size)
+        # with the default index written traces are found by id and time
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(stream, fname, override='if-changed')
+            writeh5(stream, fname, mode='a', override='if-changed')
+            st3 = readh5(fname)
+            writeh5(stream2, fname, mode='a', override='if-changed')
+            st4 = readh5(fname)
+        self.assertEqual(st3, stream)
+        self.assertEqual(st4.sort(), stream2.sort())
+
+    def test_compression_auto(self):
+        stream = self.stream.copy()
+        rng = np.random.default_rng(42)
+        counts = np.cumsum(rng.integers(-50, 50, 3000)).astype('int64')
+        stream[0].data = counts
+        stream[1].data = stream[1].data.astype('float32').astype('float64')
+        stream[2].data = stream[2].data.astype('float64') * np.pi
+        with NamedTemporaryFile(suffix='.h5') as ft:
+            fname = ft.name
+            writeh5(stream, fname, compression='auto')
+            with h5py.File(fname, 'r') as f:
+                attrs = {}
+                for path in f[obspyh5._HEADER_TABLE]['path']:
+                    dataset = f[path]
+                    attrs[dataset.attrs['channel']] = (
+                        dataset.attrs['_codec'], dataset.dtype,
+                        dataset.attrs.get('_dtype'))
+            stream2 = readh5(fname)
+            lazy_data = [tr.data for tr in readh5(fname, lazy=True)]
+            data, _ = read_array(fname, seed_id='*Z')
+            writeh5(stream, fname, compression='auto',
+                    compression_opts={'tolerance': 0, 'downcast': False,
+                                      'candidates': ['none', 'lzf']})
+            stream4 = readh5(fname)
+            with h5py.File(fname, 'r') as f:
+                path = f[obspyh5._HEADER_TABLE]['path'][0]
+                self.assertEqual(f[path].dtype, stream[0].data.dtype)
+                self.assertEqual(f[path].compression, 'lzf')
+            with self.assertRaises(ValueError):
+                writeh5(stream, fname, compression='auto', layout='packed')
+            for candidates in ([], ['bzip2']):
+                with self.assertRaises(ValueError):
+                    writeh5(stream, fname, compression='auto',
+                            compression_opts={'candidates': candidates})
+            writeh5(stream, fname, compression='auto',
+                    compression_opts={'candidates': ['scaleoffset']})
+            stream6 = readh5(fname)
+            # only the automatic downcast is undone
+            writeh5(stream, fname, compression='auto', dtype='float32')
+            stream7 = readh5(fname)
+            # updating headers keeps the codec and the original data type
+            updated = []
+            for header_codec in obspyh5._HEADER_CODECS:
+                writeh5(stream, fname, compression='auto',
+                        header_codec=header_codec)
+                update_headers(fname, {'seed_id': '*Z'}, {'calib': 2.0})
+                with h5py.File(fname, 'r') as f:
+                    path = f[obspyh5._HEADER_TABLE]['path'][0]
+                    self.assertIn('_codec', f[path].attrs)
+                    self.assertNotIn('_dtype', f[path].attrs.get('_json', ''))
+                updated.append((read_array(fname, seed_id='*Z'),
+                                readh5(fname, seed_id='*Z')))
+        for (data5, _), stream5 in updated:
+            self.assertEqual(data5.dtype, np.int64)
+            self.assertEqual(stream5[0].data.dtype, np.int64)
+            self.assertNotIn('_dtype', stream5[0].stats)
+            self.assertEqual(stream5[0].stats.calib, 2.0)
+        self.assertEqual(stream6, stream)
+        for tr in stream7:
+            self.assertEqual(tr.data.dtype, np.float32)
+        codec, dtype, orig = attrs['EHZ']
+        self.assertIn(codec, ('lzf', 'scaleoffset', 'gzip'))
+        self.assertEqual((dtype, orig), (np.int16, '<i8'))
+        self.assertEqual(attrs['EHN'][1:], (np.float32, '<f8'))
+        self.assertEqual(attrs['EHE'][1:], (np.float64, None))
+        for tr, lazy in zip(stream, lazy_data):
+            self.assertEqual(lazy.dtype, tr.data.dtype)
+            np.testing.assert_array_equal(lazy, tr.data)
+        for st in (stream2, stream4):
+            self.assertEqual(st, stream)
+            for tr, tr2 in zip(st, stream):
+                self.assertEqual(tr.data.dtype, tr2.data.dtype)
+            self.assertNotIn('_codec', st[0].stats)
+            self.assertNotIn('_dtype', st[0].stats)
+        self.assertEqual(data.dtype, np.int64)
+        np.testing.assert_array_equal(data[0], counts)
+
     def test_stored_index(self):
         stream = self.stream
         try: